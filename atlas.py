@@ -0,0 +1,75 @@
+'''Packs the block and sky box textures into a single texture atlas
+so a whole chunk can be drawn with one glBindTexture.'''
+
+import numpy
+import pygame
+
+def pack(sizes, width):
+    '''Places rectangles on shelves of a strip of the given width.
+
+    Takes a dictionary of key -> (width, height) and returns a
+    dictionary of key -> (x, y) along with the height of the strip.
+    Every rectangle gets a one pixel border of its own, so the
+    positions returned are those of the inside of the rectangles.'''
+    positions = {}
+    x = 0
+    y = 0
+    shelf = 0
+    for key in sorted(sizes, key=lambda key: (-sizes[key][1], key)):
+        w, h = sizes[key]
+        if w + 2 > width:
+            raise ValueError("a %dx%d texture does not fit in a %d pixel wide atlas" % (w, h, width))
+        if x + w + 2 > width:
+            x = 0
+            y += shelf
+            shelf = 0
+        positions[key] = (x + 1, y + 1)
+        x += w + 2
+        shelf = max(shelf, h + 2)
+    return positions, y + shelf
+
+def power_of_two(n):
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+class Atlas:
+    '''One big image holding many textures.
+
+    uvs is an array indexed by the ids the textures were given,
+    holding the (u0, v0, u1, v1) rectangle each one covers in the
+    atlas.  texture_id is left for whoever uploads the atlas to fill in.'''
+
+    def __init__(self, files, width=256):
+        images = {}
+        for texture_id, location in files.items():
+            images[texture_id] = pygame.image.load(location)
+        sizes = dict((texture_id, image.get_size()) for texture_id, image in images.items())
+        width = power_of_two(max([width] + [w + 2 for w, h in sizes.values()]))
+        positions, height = pack(sizes, width)
+        height = power_of_two(height)
+
+        self.surface = pygame.Surface((width, height))
+        self.uvs = numpy.zeros((max(images) + 1, 4), numpy.float32)
+        for texture_id, image in images.items():
+            x, y = positions[texture_id]
+            w, h = sizes[texture_id]
+
+            # copies the edges of the texture into its border so
+            # sampling right at the edge never picks up a neighbor
+            for dx in [-1, 0, 1]:
+                for dy in [-1, 0, 1]:
+                    self.surface.blit(image, (x + dx, y + dy))
+            self.surface.blit(image, (x, y))
+
+            # the atlas is flipped when it is uploaded, so v counts
+            # up from the bottom of the image
+            self.uvs[texture_id] = (x / float(width), (height - y - h) / float(height),
+                                    (x + w) / float(width), (height - y) / float(height))
+        self.texture_id = None
+
+    def uv(self, texture_id, u, v):
+        '''Maps a texture coordinate of one texture onto the atlas.'''
+        u0, v0, u1, v1 = self.uvs[texture_id]
+        return (u0 + u * (u1 - u0), v0 + v * (v1 - v0))
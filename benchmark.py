@@ -0,0 +1,202 @@
+'''Times the world generation passes for a few world sizes.
+
+Run with:  python benchmark.py'''
+
+import math, multiprocessing, random, shutil, tempfile, time
+
+import blocks, mesher
+from noise import Noise
+from store import RegionStore, save_chunks, load_world
+from terrain import Terrain, generate_world
+from world import World, Chunk
+
+world_sizes = [64, 128, 256]
+world_height = 32
+world_min_terrain = 5
+
+def runtime(function, args=[]):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+def rolling_terrain(world):
+    '''Fills the world with simple rolling hills, which gives the
+    passes about as much work as real terrain does.'''
+    for x in range(0, world.size):
+        for z in range(0, world.size):
+            height = world.min_terrain + int((math.sin(x / 9.0) + math.cos(z / 7.0) + 2) * 4)
+            for y in range(world.min_terrain, height + 1):
+                if y == height:
+                    block = blocks.GRASS
+                elif y < height - 2:
+                    block = blocks.STONE
+                else:
+                    block = blocks.DIRT
+                world.set(x, y, z, block)
+
+def benchmark_passes():
+    '''Prints how update_neighbors and generate_light scale with
+    the size of the world.'''
+    print("%6s %8s %12s %18s %16s" % ("size", "chunks", "blocks", "update_neighbors", "generate_light"))
+    for size in world_sizes:
+        random.seed(0)
+        world = World(size, world_height, world_min_terrain)
+        world.generate_chunks()
+        rolling_terrain(world)
+        neighbors = runtime(world.update_neighbors)
+        light = runtime(world.generate_light)
+        print("%6d %8d %12d %17.2fs %15.2fs" % (size, len(world.chunks), size * size * world_height, neighbors, light))
+
+def benchmark_chunks(count=256):
+    '''Prints how much memory a chunk takes and how long it
+    takes to build one.'''
+    world = World(16, world_height, world_min_terrain)
+    start = time.time()
+    for i in range(0, count):
+        chunk = Chunk(0, 0, world)
+    build = (time.time() - start) / count
+    print("%8s %14s %16s" % ("height", "bytes/chunk", "construction"))
+    print("%8d %14d %15.3fms" % (world_height, chunk.nbytes(), build * 1000))
+
+def benchmark_meshing(size=80, height=32):
+    '''Prints the vertex counts and meshing times of per-face and
+    greedy meshing, and of meshing from bigger blocks for distant
+    chunks, on the standard world.'''
+    random.seed(0)
+    world = World(size, height, world_min_terrain)
+    world.generate_chunks()
+    rolling_terrain(world)
+    world.update_neighbors()
+    world.generate_light()
+    print("%8s %10s %10s" % ("meshing", "vertices", "time"))
+    for greedy in [False, True]:
+        vertices = 0
+        start = time.time()
+        for chunk in world.chunks.values():
+            vertices += len(mesher.build_mesh(world, chunk, greedy=greedy)[0])
+        print("%8s %10d %9.2fs" % (["faces", "greedy"][greedy], vertices, time.time() - start))
+    for scale in [2, 4]:
+        vertices = 0
+        start = time.time()
+        for chunk in world.chunks.values():
+            vertices += len(mesher.build_mesh(world, chunk, scale=scale)[0])
+        print("%8s %10d %9.2fs" % ("lod %d" % scale, vertices, time.time() - start))
+
+def benchmark_heights(size=64, heights=[32, 128, 256]):
+    '''Prints the memory a chunk takes and how long the passes take
+    as the world gets taller with nothing but air on top.'''
+    print("%8s %14s %18s %16s %10s" % ("height", "bytes/chunk", "update_neighbors", "generate_light", "meshing"))
+    for height in heights:
+        random.seed(0)
+        world = World(size, height, world_min_terrain)
+        world.generate_chunks()
+        rolling_terrain(world)
+        neighbors = runtime(world.update_neighbors)
+        light = runtime(world.generate_light)
+        start = time.time()
+        for chunk in world.chunks.values():
+            mesher.build_mesh(world, chunk)
+        nbytes = sum([chunk.nbytes() for chunk in world.chunks.values()]) // len(world.chunks)
+        print("%8d %14d %17.2fs %15.2fs %9.2fs" % (height, nbytes, neighbors, light, time.time() - start))
+
+def benchmark_packing(size=64, height=64, count=20000):
+    '''Prints the memory the block ids of a chunk take and how long
+    reading and writing single blocks takes, kept as sections of
+    arrays and palette packed, next to one plain array.'''
+    terrain = Terrain(0, size, height, world_min_terrain, 20, 12, True)
+    print("%8s %14s %12s %12s" % ("blocks", "bytes/chunk", "get", "set"))
+    print("%8s %14d" % ("dense", 16 * height * 16))
+    for packed in [False, True]:
+        world = World(size, height, world_min_terrain, packed=packed)
+        generate_world(world, terrain, 1)
+        nbytes = sum([chunk.blocks.nbytes for chunk in world.chunks.values()]) // len(world.chunks)
+        random.seed(0)
+        points = [(random.randrange(size), random.randrange(height), random.randrange(size)) for i in range(0, count)]
+        gets = runtime(lambda: [world.get(x, y, z) for x, y, z in points])
+        sets = runtime(lambda: [world.set(x, y, z, blocks.BRICK) for x, y, z in points])
+        print("%8s %14d %10.2fus %10.2fus" % (["sections", "packed"][packed], nbytes,
+                                             gets * 1000000 / count, sets * 1000000 / count))
+
+def benchmark_columns(size=64, heights=[64, 256, 1024, 4096], count=20000):
+    '''Prints the memory the block ids of a chunk take and how long
+    reading a single block takes on rolling hills as the world gets
+    taller, kept as one plain array, as sections, palette packed and
+    as runs down each column.'''
+    print("%8s %10s %14s %12s" % ("height", "blocks", "bytes/chunk", "get"))
+    for height in heights:
+        random.seed(0)
+        points = [(random.randrange(size), random.randrange(height), random.randrange(size)) for i in range(0, count)]
+        for kind in ["dense", "sections", "packed", "columns"]:
+            world = World(size, height, world_min_terrain, packed=kind == "packed", columns=kind == "columns")
+            world.generate_chunks()
+            rolling_terrain(world)
+            if kind == "dense":
+                arrays = dict([(key, chunk.blocks.dense()) for key, chunk in world.chunks.items()])
+                nbytes = 16 * height * 16
+                get = runtime(lambda: [int(arrays[(x >> 4, z >> 4)][x & 15, y, z & 15]) for x, y, z in points])
+            else:
+                nbytes = sum([chunk.blocks.nbytes for chunk in world.chunks.values()]) // len(world.chunks)
+                get = runtime(lambda: [world.get(x, y, z) for x, y, z in points])
+            print("%8d %10s %14d %10.2fus" % (height, kind, nbytes, get * 1000000 / count))
+
+def benchmark_caves():
+    '''Prints how long the cave noise takes for every chunk of
+    the world.'''
+    noise = Noise(0)
+    print("%6s %8s %10s" % ("size", "chunks", "caves"))
+    for size in world_sizes:
+        start = time.time()
+        for x in range(0, size, 16):
+            for z in range(0, size, 16):
+                noise.perlin_grid_3d(x, 2, z, 16, world_height - 2, 16)
+        print("%6d %8d %9.2fs" % (size, (size // 16)**2, time.time() - start))
+
+def benchmark_generation(size=128):
+    '''Prints how long generating the world takes with more and
+    more worker processes.'''
+    print("%10s %8s %12s" % ("processes", "chunks", "generation"))
+    for processes in range(1, multiprocessing.cpu_count() + 1):
+        terrain = Terrain(0, size, world_height, world_min_terrain, 20, 12, True)
+        world = World(size, world_height, world_min_terrain)
+        print("%10d %8d %11.2fs" % (processes, (size // 16)**2, runtime(generate_world, [world, terrain, processes])))
+
+def benchmark_saving(size=256):
+    '''Prints how long it takes to generate a world, save it and
+    load it back.'''
+    directory = tempfile.mkdtemp()
+    terrain = Terrain(0, size, world_height, world_min_terrain, 20, 12, True)
+    world = World(size, world_height, world_min_terrain)
+    generate = runtime(generate_world, [world, terrain, 1])
+    generate += runtime(world.update_neighbors)
+    generate += runtime(world.generate_light)
+    store = RegionStore(directory, world_height)
+    save = runtime(save_chunks, [world, store, list(world.chunks.values())])
+    store.close()
+
+    store = RegionStore(directory, world_height)
+    world = World(size, world_height, world_min_terrain)
+    load = runtime(load_world, [world, store])
+    load += runtime(world.update_neighbors)
+    store.close()
+    shutil.rmtree(directory)
+    print("%6s %10s %8s %8s" % ("size", "generate", "save", "load"))
+    print("%6d %9.2fs %7.2fs %7.2fs" % (size, generate, save, load))
+
+if __name__ == "__main__":
+    benchmark_chunks()
+    print("")
+    benchmark_passes()
+    print("")
+    benchmark_meshing()
+    print("")
+    benchmark_heights()
+    print("")
+    benchmark_packing()
+    print("")
+    benchmark_columns()
+    print("")
+    benchmark_caves()
+    print("")
+    benchmark_generation()
+    print("")
+    benchmark_saving()
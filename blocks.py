@@ -0,0 +1,36 @@
+'''The block type registry.  Chunks only store the id of each block,
+everything else about a kind of block lives here.'''
+
+class BlockType:
+    '''Describes one kind of block.'''
+
+    def __init__(self, id, name, texture_ids, breakable=True):
+        self.id = id
+        self.name = name
+
+        # one texture id per face (front, back, right, left, top, bottom)
+        self.texture_ids = texture_ids
+
+        self.breakable = breakable
+
+block_types = []
+block_ids = {}
+
+def register(name, texture_ids, breakable=True):
+    '''Adds a new kind of block and returns its id.'''
+    block_type = BlockType(len(block_types), name, texture_ids, breakable)
+    block_types.append(block_type)
+    block_ids[name] = block_type.id
+    return block_type.id
+
+# the texture ids follow the order the textures are loaded in main.py
+AIR = register("air", [1, 1, 1, 1, 1, 1])
+BEDROCK = register("bedrock", [9, 9, 9, 9, 9, 9], breakable=False)
+STONE = register("stone", [2, 2, 2, 2, 2, 2])
+GRASS = register("grass", [3, 3, 3, 3, 4, 5])
+DIRT = register("dirt", [5, 5, 5, 5, 5, 5])
+TREE = register("tree", [7, 7, 7, 7, 6, 6])
+LEAF = register("leaf", [8, 8, 8, 8, 8, 8])
+BRICK = register("brick", [10, 10, 10, 10, 10, 10])
+IRON = register("iron", [15, 15, 15, 15, 15, 15])
+SAND = register("sand", [16, 16, 16, 16, 16, 16])
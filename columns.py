@@ -0,0 +1,217 @@
+'''Keeps the block ids of a chunk as runs down each of its 256
+columns, for worlds so tall or so wide that even packed sections take
+too much memory.  Generated terrain is bedrock, stone, dirt and grass
+with air all the way up, a handful of runs a column however tall the
+world is.
+
+Reading a block finds its run with a binary search over the tops of
+the runs of its column.  Changing one splits the run it was in, and
+joins the pieces to the runs either side holding the same value, but
+the runs of the whole chunk are kept in flat arrays, so every change
+copies them: this suits worlds that are mostly read.'''
+
+import bisect
+
+import numpy
+
+from sections import Sections
+
+class Columns(Sections):
+    '''A 16 x height x 16 column of values kept as runs, which reads
+    and writes just like Sections.
+
+    The runs of column x * 16 + z are offsets[column] up to
+    offsets[column + 1] of tops and values, from the bottom up, each
+    reaching from the top of the run under it, or 0, up to its own
+    top.  The same value never runs twice in a row.'''
+
+    def __init__(self, height, value=0, dtype=numpy.uint8):
+        self.height = height
+        self.dtype = numpy.dtype(dtype)
+        self.offsets = numpy.arange(0, 257, dtype=numpy.int32)
+        self.tops = numpy.zeros(256, self.tops_dtype) + height
+        self.values = numpy.zeros(256, self.dtype) + value
+
+    @property
+    def tops_dtype(self):
+        return numpy.dtype("<u2" if self.height < 1 << 16 else "<u4")
+
+    @property
+    def count(self):
+        return (self.height + 15) // 16
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.tops.nbytes + self.values.nbytes
+
+    def starts(self):
+        '''Returns the column of each run and the y it starts at.'''
+        columns = numpy.repeat(numpy.arange(0, 256), numpy.diff(self.offsets))
+        starts = numpy.zeros(len(self.tops), numpy.int64)
+        starts[1:] = self.tops[:-1]
+        starts[self.offsets[:-1]] = 0
+        return columns, starts
+
+    def window(self, bottom, top):
+        '''Returns the starts, tops and values of the runs from bottom
+        up to top, cut off at bottom and top.'''
+        columns, starts = self.starts()
+        tops = self.tops.astype(numpy.int64)
+        inside = (starts < top) & (tops > bottom)
+        return (numpy.maximum(starts[inside], bottom), numpy.minimum(tops[inside], top),
+                self.values[inside])
+
+    def uniform(self, index):
+        bottom, top = self.span(index)
+        starts, tops, values = self.window(bottom, top)
+        if len(values) == 256 and (values == values[0]).all():
+            return int(values[0])
+        return None
+
+    def section(self, index):
+        return self.dense(*self.span(index))
+
+    def region(self, x, bottom, top, z):
+        if isinstance(x, slice) or isinstance(z, slice):
+            return self.dense(bottom, top)[x, :, z]
+
+        # a single column only needs its own runs
+        column, low, high, run = self.find(x, bottom, z)
+        tops = numpy.minimum(self.tops[low:high].astype(numpy.int64), top)
+        starts = numpy.maximum(numpy.concatenate([[0], tops[:-1]]), bottom)
+        lengths = numpy.maximum(tops - starts, 0)
+        return numpy.repeat(self.values[low:high], lengths)
+
+    def dense(self, bottom=0, top=None):
+        if top is None:
+            top = self.height
+        starts, tops, values = self.window(bottom, top)
+        blocks = numpy.repeat(values, tops - starts)
+        return blocks.reshape(16, 16, top - bottom).transpose(0, 2, 1).copy()
+
+    def fill(self, value, bottom=0, top=None):
+        if isinstance(value, numpy.ndarray):
+            top = bottom + value.shape[1]
+        elif top is None:
+            top = self.height
+        if bottom >= top:
+            return
+        if isinstance(value, numpy.ndarray):
+            columns, tops, values = array_runs(value)
+            tops = tops + bottom
+        else:
+            columns = numpy.arange(0, 256)
+            tops = numpy.zeros(256, numpy.int64) + top
+            values = numpy.zeros(256, self.dtype) + value
+
+        # the runs under bottom are cut off there, the runs over top
+        # keep their tops and the new runs go in between
+        old_columns, starts = self.starts()
+        old_tops = self.tops.astype(numpy.int64)
+        below = starts < bottom
+        above = old_tops > top
+        columns = numpy.concatenate([old_columns[below], columns, old_columns[above]])
+        tops = numpy.concatenate([numpy.minimum(old_tops[below], bottom), tops, old_tops[above]])
+        values = numpy.concatenate([self.values[below], numpy.asarray(values, self.dtype), self.values[above]])
+        order = numpy.lexsort((tops, columns))
+        self.set_runs(columns[order], tops[order], values[order])
+
+    def set_runs(self, columns, tops, values):
+        '''Keeps runs sorted by column and top, joining runs that hold
+        the same value as the run over them.'''
+        keep = numpy.ones(len(values), bool)
+        keep[:-1] = (columns[1:] != columns[:-1]) | (values[1:] != values[:-1])
+        counts = numpy.bincount(columns[keep], minlength=256)
+        self.offsets = numpy.zeros(257, numpy.int32)
+        self.offsets[1:] = numpy.cumsum(counts)
+        self.tops = tops[keep].astype(self.tops_dtype)
+        self.values = values[keep].astype(self.dtype)
+
+    def find(self, x, y, z):
+        '''Returns the column of x, z, its runs and the run holding y.'''
+        column = x * 16 + z
+        low, high = int(self.offsets[column]), int(self.offsets[column + 1])
+        return column, low, high, bisect.bisect_right(self.tops, y, low, high)
+
+    def get(self, x, y, z):
+        return self.values[self.find(x, y, z)[3]]
+
+    def set(self, x, y, z, value):
+        column, low, high, run = self.find(x, y, z)
+        old = self.values[run]
+        if old == value:
+            return
+        start = int(self.tops[run - 1]) if run > low else 0
+        end = int(self.tops[run])
+
+        # splits the run around the block
+        parts = []
+        if y > start:
+            parts.append((y, old))
+        parts.append((y + 1, value))
+        if end > y + 1:
+            parts.append((end, old))
+
+        # and joins the block to the runs either side of the same value
+        first, last = run, run + 1
+        if y == start and run > low and self.values[run - 1] == value:
+            first -= 1
+        if y + 1 == end and run + 1 < high and self.values[run + 1] == value:
+            last += 1
+            parts[-1] = (self.tops[run + 1], value)
+        tops = numpy.array([part[0] for part in parts], self.tops_dtype)
+        values = numpy.array([part[1] for part in parts], self.dtype)
+        self.tops = numpy.concatenate([self.tops[:first], tops, self.tops[last:]])
+        self.values = numpy.concatenate([self.values[:first], values, self.values[last:]])
+        self.offsets[column + 1:] += len(parts) - (last - first)
+
+    def copy(self):
+        copy = Columns(self.height, 0, self.dtype)
+        copy.offsets = self.offsets.copy()
+        copy.tops = self.tops.copy()
+        copy.values = self.values.copy()
+        return copy
+
+    def __getitem__(self, key):
+        x, y, z = key
+        if not isinstance(x, slice) and not isinstance(y, slice) and not isinstance(z, slice):
+            return self.get(x, y, z)
+        return self.get_slice(x, y, z)
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, tuple):
+            key = (key, slice(None), slice(None))
+        x, y, z = key
+        if not isinstance(x, slice) and not isinstance(y, slice) and not isinstance(z, slice):
+            self.set(x, y, z, value)
+            return
+        self.set_slice(x, y, z, value)
+
+    def tobytes(self):
+        '''Returns the end of the runs of each column, then the tops
+        and values of the runs, ready to save as they are.'''
+        return (numpy.asarray(self.offsets[1:], "<u4").tobytes() + self.tops.tobytes() +
+                self.values.tobytes())
+
+    @staticmethod
+    def frombytes(data, offset, height):
+        '''Reads Columns written by tobytes.  Returns them and the
+        offset just past them.'''
+        columns = Columns(height)
+        columns.offsets = numpy.zeros(257, numpy.int32)
+        columns.offsets[1:] = numpy.frombuffer(data, "<u4", 256, offset)
+        offset += 256 * 4
+        runs = int(columns.offsets[-1])
+        columns.tops = numpy.frombuffer(data, columns.tops_dtype, runs, offset).copy()
+        offset += runs * columns.tops_dtype.itemsize
+        columns.values = numpy.frombuffer(data, numpy.uint8, runs, offset).copy()
+        return columns, offset + runs
+
+def array_runs(array):
+    '''Returns the column, top and value of every run down the columns
+    of a 16 x h x 16 array, sorted by column and top.'''
+    columns = numpy.asarray(array).transpose(0, 2, 1).reshape(256, -1)
+    ends = numpy.ones(columns.shape, bool)
+    ends[:, :-1] = columns[:, 1:] != columns[:, :-1]
+    column, y = numpy.nonzero(ends)
+    return column, y + 1, columns[column, y]
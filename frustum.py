@@ -0,0 +1,32 @@
+'''Finds which chunks are inside the view frustum, the part of the
+world the camera can see.'''
+
+import numpy
+
+def planes(projection, modelview):
+    '''Returns the six planes of the view frustum (left, right,
+    bottom, top, near, far) as the rows of a 6 x 4 array (a, b, c, d),
+    with a point x, y, z inside a plane when ax + by + cz + d >= 0.
+
+    Takes the matrices the way glGetDoublev returns them, which is
+    the transpose of the matrix, since OpenGL lists them a column at
+    a time.'''
+    clip = numpy.dot(numpy.asarray(modelview, float), numpy.asarray(projection, float)).T
+    rows = [clip[3] + clip[0], clip[3] - clip[0],
+            clip[3] + clip[1], clip[3] - clip[1],
+            clip[3] + clip[2], clip[3] - clip[2]]
+    return numpy.array(rows)
+
+def inside(frustum, boxes):
+    '''Tells which boxes, the rows of an N x 6 array (min x, y, z,
+    max x, y, z), are at least partly inside the frustum.
+
+    A box is only left out when it lies wholly on the outer side of
+    one of the planes, so no box that shows on screen is ever left
+    out, though a few that do not show may be let through.'''
+    boxes = numpy.asarray(boxes, float).reshape(-1, 6)
+    normals = frustum[:, numpy.newaxis, 0:3]
+
+    # the corner of each box furthest along the normal of each plane
+    corners = numpy.where(normals >= 0, boxes[numpy.newaxis, :, 3:6], boxes[numpy.newaxis, :, 0:3])
+    return ((corners * normals).sum(axis=2) + frustum[:, 3:4] >= 0).all(axis=0)
@@ -0,0 +1,217 @@
+'''Works out how much light reaches every air block.
+
+Sunlight shines straight down every column until it meets the first
+solid block, so each chunk keeps a heightmap of the lowest block the
+sky reaches in each column.  Every one of those blocks has the
+maximum light, and from them light spreads out breadth first, one
+level weaker with every block it goes, until it fades to the minimum
+light, which is as dark as any air block gets.  Solid blocks have
+no light of their own.
+
+The light of a whole area is worked out with arrays, one ring of the
+breadth first search at a time, only between the lowest section with
+any air in it and the highest with anything but air: everything
+under is solid and dark and everything over is sky.  When a single
+block changes only the light around it is worked out again, with
+queues.'''
+
+import collections
+
+import numpy
+
+from blocks import AIR
+from sections import Sections, section_height
+
+def sky_heights(solid):
+    '''Returns the lowest y the sky reaches in each column, given
+    which blocks are solid in an array indexed [x, y, z].'''
+    height = solid.shape[1]
+    if height == 0:
+        return numpy.zeros((solid.shape[0], solid.shape[2]), int)
+    heights = height - numpy.argmax(solid[:, ::-1, :], axis=1)
+    heights[~solid.any(axis=1)] = 0
+    return heights
+
+def spread(solid, heights, maximum_light, minimum_light):
+    '''Returns the light of every block of an area, given which of
+    its blocks are solid and the sky heightmap of its columns.  Light
+    from outside the area is not counted.'''
+    y = numpy.arange(0, solid.shape[1])[numpy.newaxis, :, numpy.newaxis]
+    frontier = y >= heights[:, numpy.newaxis, :]
+    light = numpy.where(frontier, maximum_light, 0).astype(numpy.uint8)
+    air = ~solid
+    for level in range(maximum_light - 1, minimum_light, -1):
+        reached = numpy.zeros(frontier.shape, bool)
+        reached[1:, :, :] |= frontier[:-1, :, :]
+        reached[:-1, :, :] |= frontier[1:, :, :]
+        reached[:, 1:, :] |= frontier[:, :-1, :]
+        reached[:, :-1, :] |= frontier[:, 1:, :]
+        reached[:, :, 1:] |= frontier[:, :, :-1]
+        reached[:, :, :-1] |= frontier[:, :, 1:]
+        frontier = reached & air & (light == 0)
+        if not frontier.any():
+            break
+        light[frontier] = level
+    light[air & (light < minimum_light)] = minimum_light
+    return light
+
+def window(chunks):
+    '''Returns the bottom and top y of the part of some chunks that
+    light has to be worked out for.'''
+    bottom = min([chunk.solid_sections() for chunk in chunks]) * section_height
+    top = max([chunk.top() for chunk in chunks])
+    return bottom, max(top, bottom)
+
+def store_light(world, chunk, light, bottom, top):
+    '''Gives a chunk the light worked out between bottom and top.'''
+    chunk.light = Sections(world.height, world.maximum_light)
+    chunk.light.fill(0, 0, bottom)
+    chunk.light.fill(light, bottom)
+
+def light_world(world):
+    '''Lights every chunk of the world in one go.'''
+    if not world.chunks:
+        return
+    size = (world.size + 15) // 16 * 16
+    bottom, top = window(list(world.chunks.values()))
+    solid = numpy.ones((size, top - bottom, size), bool)
+    for chunk in world.chunks.values():
+        solid[chunk.x:chunk.x + 16, :, chunk.z:chunk.z + 16] = chunk.blocks.dense(bottom, top) != AIR
+    heights = sky_heights(solid)
+    light = spread(solid, heights, world.maximum_light, world.minimum_light)
+    for chunk in world.chunks.values():
+        chunk.heights = heights[chunk.x:chunk.x + 16, chunk.z:chunk.z + 16] + bottom
+        store_light(world, chunk, light[chunk.x:chunk.x + 16, :, chunk.z:chunk.z + 16], bottom, top)
+
+def light_chunk(world, chunk):
+    '''Lights a chunk from the chunks around it, for when the rest of
+    the world is not there to be lit along with it.
+
+    Light never spreads further than the gap between the maximum and
+    minimum light, which is less than a chunk, so lighting the chunk
+    together with the eight around it gets it right.  So does the
+    one block border around the chunk, which is returned the same
+    way World.padded returns it, ready for the mesher.'''
+    around = {}
+    for dx in [-1, 0, 1]:
+        for dz in [-1, 0, 1]:
+            x = chunk.x + dx * 16
+            z = chunk.z + dz * 16
+            if x >= 0 and z >= 0 and x < world.size and z < world.size:
+                around[(dx, dz)] = world.chunks.get((x >> 4, z >> 4))
+
+    # a chunk that is not there yet is all air
+    if None in around.values():
+        bottom, top = 0, window([other for other in around.values() if other is not None])[1]
+    else:
+        bottom, top = window(list(around.values()))
+    solid = numpy.ones((48, top - bottom, 48), bool)
+    for dx in [-1, 0, 1]:
+        for dz in [-1, 0, 1]:
+            if (dx, dz) not in around:
+                continue
+            other = around[(dx, dz)]
+            area = (slice(16 + dx * 16, 32 + dx * 16), slice(None), slice(16 + dz * 16, 32 + dz * 16))
+            solid[area] = other is not None and other.blocks.dense(bottom, top) != AIR
+    heights = sky_heights(solid)
+    light = spread(solid, heights, world.maximum_light, world.minimum_light)
+    store_light(world, chunk, light[16:32, :, 16:32], bottom, top)
+    chunk.heights = heights[16:32, 16:32] + bottom
+
+    padded = numpy.empty((18, world.height + 2, 18), numpy.uint8)
+    padded[:, 0:bottom + 1, :] = 0
+    padded[:, top + 1:, :] = world.maximum_light
+    padded[:, bottom + 1:top + 1, :] = light[15:33, :, 15:33]
+    return padded
+
+# the six blocks next to a block
+neighbors = [(0, 0, 1), (0, 0, -1), (1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0)]
+
+def relight(world, x, y, z):
+    '''Works out the light around the block at x, y, z again after it
+    has changed, and marks every chunk whose mesh the change of light
+    shows up in as needing a new mesh.'''
+    chunk = world.chunk_at(x, z)
+    if chunk is None or y < 0 or y >= world.height:
+        return
+    x, y, z = int(x), int(y), int(z)
+    column = (x - chunk.x, z - chunk.z)
+    maximum_light = world.maximum_light
+    minimum_light = world.minimum_light
+
+    def air(x, y, z):
+        return world.get(x, y, z) == AIR
+
+    def sky(x, y, z):
+        other = world.chunk_at(x, z)
+        return other.heights[x - other.x, z - other.z] <= y
+
+    changed = set()
+    def set_light(x, y, z, light):
+        world.set_light(x, y, z, light)
+        changed.add((x, y, z))
+
+    removed = collections.deque()
+    added = collections.deque()
+
+    # moves the sky up or down the column
+    old_height = int(chunk.heights[column])
+    new_height = int(sky_heights(chunk.blocks[column[0]:column[0] + 1, :, column[1]:column[1] + 1] != AIR)[0, 0])
+    chunk.heights[column] = new_height
+    for i in range(new_height, old_height):
+        set_light(x, i, z, maximum_light)
+        added.append((x, i, z))
+    for i in range(old_height, new_height):
+        if air(x, i, z):
+            removed.append((x, i, z, world.get_light(x, i, z)))
+            set_light(x, i, z, minimum_light)
+
+    # the block itself
+    if air(x, y, z):
+        if not sky(x, y, z):
+            light = minimum_light
+            for dx, dy, dz in neighbors:
+                if air(x + dx, y + dy, z + dz):
+                    light = max(light, world.get_light(x + dx, y + dy, z + dz) - 1)
+            set_light(x, y, z, light)
+            added.append((x, y, z))
+    else:
+        removed.append((x, y, z, world.get_light(x, y, z)))
+        set_light(x, y, z, 0)
+
+    # takes away the light that came from where light has gone
+    # and finds the blocks whose light has to spread back in
+    while removed:
+        x, y, z, light = removed.popleft()
+        for dx, dy, dz in neighbors:
+            nx, ny, nz = x + dx, y + dy, z + dz
+            if not air(nx, ny, nz):
+                continue
+            other = world.get_light(nx, ny, nz)
+            if other > minimum_light and other < light:
+                set_light(nx, ny, nz, minimum_light)
+                removed.append((nx, ny, nz, other))
+            elif other >= light:
+                added.append((nx, ny, nz))
+
+    # spreads light out again
+    while added:
+        x, y, z = added.popleft()
+        light = world.get_light(x, y, z) - 1
+        if light <= minimum_light:
+            continue
+        for dx, dy, dz in neighbors:
+            nx, ny, nz = x + dx, y + dy, z + dz
+            if air(nx, ny, nz) and world.get_light(nx, ny, nz) < light:
+                set_light(nx, ny, nz, light)
+                added.append((nx, ny, nz))
+
+    # faces are lit by the block in front of them, which may be
+    # in the chunk next door
+    keys = set()
+    for x, y, z in changed:
+        for dx, dz in [(0, 0), (1, 0), (-1, 0), (0, 1), (0, -1)]:
+            keys.add(((x + dx) >> 4, (z + dz) >> 4))
+    for key in keys:
+        if key in world.chunks:
+            world.chunks[key].touch()
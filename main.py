@@ -1,4 +1,4 @@
-import math, random, sys, time
+import ctypes, math, os, random, sys, time
 
 # openggl
 from OpenGL.GL import *
@@ -11,6 +11,25 @@ from pygame.locals import *
 # matrix
 from gameobjects.matrix44 import *
 
+# world
+import blocks
+from blocks import block_types, AIR
+from world import World
+
+# terrain
+from terrain import Terrain, generate_world
+from streaming import Streamer
+
+# saving
+from store import RegionStore, save_level, load_level, save_chunks, load_world
+
+# meshing
+import frustum
+import mesher
+import visibility
+from atlas import Atlas
+from mesher import block_vertices, block_faces
+
 def resize(width, height):
     glViewport(0, 0, width, height)
     glMatrixMode(GL_PROJECTION)
@@ -45,11 +64,20 @@ def init():
     glLight(GL_LIGHT0, GL_AMBIENT,  (0.02, 0.02, 0.02, 1))
     glLight(GL_LIGHT0, GL_DIFFUSE,  (0.7, 0.7, 0.7, 1))
     
+    # chunks are drawn from vertex buffers
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+    glEnableClientState(GL_COLOR_ARRAY)
+    
 def load_texture(texture_location):
     
     # Load the textures
     texture_surface = pygame.image.load(texture_location)
     
+    return upload_texture(texture_surface)
+    
+def upload_texture(texture_surface, wrap=GL_REPEAT):
+    
     # Retrieve the texture data
     texture_data = pygame.image.tostring(texture_surface, 'RGB', True)
     
@@ -61,8 +89,8 @@ def load_texture(texture_location):
     # Tell OpenGL how to scale images
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST) 
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, wrap)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, wrap)
     #glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
     #glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
 
@@ -92,925 +120,296 @@ class SkyBox:
     for this game.  It has a single texture mapped
     across its six sides.'''
     
-    def __init__(self, texture_ids=[1, 1, 1, 1, 1, 1]):
+    def __init__(self, texture_ids=[1, 1, 1, 1, 1, 1], atlas=None):
         '''Creates the block class.'''
         
         # remembers its texure id
         self.texture_ids = texture_ids
+        
+        # the atlas all six textures are sampled from
+        self.atlas = atlas
             
     def render(self, x, y, z):
         '''Renders the block.'''
         
         global block_vertices, block_normals, block_faces
+        
+        # tells OpenGl to use the atlas for every face
+        glBindTexture(GL_TEXTURE_2D, self.atlas.texture_id)
+            
+        # begin drawing
+        glBegin(GL_QUADS)
             
         # loops through the faces
         i = 0
         for face in block_faces:
             
-            # tells OpenGl to use this texture
-            glBindTexture(GL_TEXTURE_2D, self.texture_ids[i])
-            
             # normals for shading
             #if self.light == 15:
             #    glNormal(*block_normals[i])
             
-            # begin drawing
-            glBegin(GL_QUADS)
-            
-            glTexCoord2f(0, 0)
+            glTexCoord2f(*self.atlas.uv(self.texture_ids[i], 0, 0))
             glVertex(block_vertices[face[0]][0] + x, block_vertices[face[0]][1] + y, block_vertices[face[0]][2] + z)
                     
-            glTexCoord2f(1, 0)
+            glTexCoord2f(*self.atlas.uv(self.texture_ids[i], 1, 0))
             glVertex(block_vertices[face[1]][0] + x, block_vertices[face[1]][1] + y, block_vertices[face[1]][2] + z) 
             
-            glTexCoord2f(1, 1) 
+            glTexCoord2f(*self.atlas.uv(self.texture_ids[i], 1, 1)) 
             glVertex(block_vertices[face[2]][0] + x, block_vertices[face[2]][1] + y, block_vertices[face[2]][2] + z) 
             
-            glTexCoord2f(0, 1)
+            glTexCoord2f(*self.atlas.uv(self.texture_ids[i], 0, 1))
             glVertex(block_vertices[face[3]][0] + x, block_vertices[face[3]][1] + y, block_vertices[face[3]][2] + z)   
-    
-            # stop drawing
-            glEnd()
                     
             # increments i
             i = i + 1  
-        
-class Block:
-    '''This class is the most basic building block
-    for this game.  It has a single texture mapped
-    across its six sides.'''
     
-    def __init__(self, texture_ids=[1, 1, 1, 1, 1, 1], light=0):
-        '''Creates the block class.'''
-        
-        self.air = False
-        
-        # remembers its texure id
-        self.texture_ids = texture_ids
-                       
-        self.blocked = [
-            False,
-            False,
-            False,
-            False,
-            False,
-            False
-        ]
-        
-        # light data
-        self.light = light
-            
-    def render(self, x, y, z):
-        '''Renders the block.'''
-        
-        global block_vertices, block_normals, block_faces
+        # stop drawing
+        glEnd()
         
-        if not self.air:
-            
-            # loops through the faces
-            i = 0
-            for face in block_faces:
-                    
-                if not self.blocked[i]:
-                
-                    # tells OpenGl to use this texture
-                    glBindTexture(GL_TEXTURE_2D, self.texture_ids[i])
-                    
-                    # normals for shading
-                    #if self.light > 10:
-                    #   glNormal(*block_normals[i])
-                    
-                    # begin drawing
-                    glBegin(GL_QUADS)
-                    
-                    # normals for shading
-                    #glColor(self.light / 15.0, self.light / 15.0, self.light / 15.0)
-                    glColor(*get_color(block_vertices[face[0]][0] + x, block_vertices[face[0]][1] + y, block_vertices[face[0]][2] + z, block_normals[i]))
-                    glTexCoord2f(0, 0)
-                    glVertex(block_vertices[face[0]][0] + x, block_vertices[face[0]][1] + y, block_vertices[face[0]][2] + z)
-                     
-                    glColor(*get_color(block_vertices[face[1]][0] + x, block_vertices[face[1]][1] + y, block_vertices[face[1]][2] + z, block_normals[i]))
-                    glTexCoord2f(1, 0)
-                    glVertex(block_vertices[face[1]][0] + x, block_vertices[face[1]][1] + y, block_vertices[face[1]][2] + z) 
-                    
-                    glColor(*get_color(block_vertices[face[2]][0] + x, block_vertices[face[2]][1] + y, block_vertices[face[2]][2] + z, block_normals[i]))
-                    glTexCoord2f(1, 1) 
-                    glVertex(block_vertices[face[2]][0] + x, block_vertices[face[2]][1] + y, block_vertices[face[2]][2] + z) 
-                    
-                    glColor(*get_color(block_vertices[face[3]][0] + x, block_vertices[face[3]][1] + y, block_vertices[face[3]][2] + z, block_normals[i]))
-                    glTexCoord2f(0, 1)
-                    glVertex(block_vertices[face[3]][0] + x, block_vertices[face[3]][1] + y, block_vertices[face[3]][2] + z)   
-            
-                    # stop drawing
-                    glEnd()
-                        
-                # increments i
-                i = i + 1           
-                
-            
-    def update_neighbors(self, x, y, z):
+def build_chunk_mesh(chunk, scale=1):
+    '''Rebuilds the vertex buffer of a chunk, from blocks scale times
+    as big as normal.'''
+    
+    global world, atlas, greedy_meshing
+    
+    vertices, batches = mesher.build_mesh(world, chunk, atlas, greedy_meshing, scale=scale)
+    chunk.scale = scale
+    chunk.connections = visibility.connections(chunk.blocks)
+    chunk.dirty = False
+    upload_chunk_mesh(chunk, vertices, batches)
+    
+def rebuild_chunks(budget):
+    '''Rebuilds the meshes of the chunks that need a new one, nearest
+    first and, a chunk apart, those inside the view frustum before
+    those outside it, until budget seconds have passed.  At least one
+    is rebuilt each frame.  The rest keep drawing their old mesh until
+    a later frame gets to them.'''
+    
+    global world, translate, lod_distances, rebuild_queue, rebuild_time
+    
+    start = time.time()
+    waiting = []
+    for chunk in world.chunks.values():
+        distance = math.sqrt((translate[0] - (chunk.x + 8))**2 + (translate[2] - (chunk.z + 8))**2)
+        scale = mesher.lod_scale(distance, lod_distances)
+        if chunk.dirty or chunk.scale != scale:
+            waiting.append((distance, chunk, scale))
+    if waiting:
         
-        global world_size, block_normals
-            
-        i = 0
-        for normal in block_normals:
-            blocker = [x, y, z]
-            blocker[0] += normal[0]
-            blocker[1] += normal[1]
-            blocker[2] += normal[2]
-            if blocker[0] < 0:
-                self.blocked[i] = True
-            elif blocker[0] > world_size - 1:
-                self.blocked[i] = True
-            elif blocker[1] < 0:
-                self.blocked[i] = True
-            elif blocker[2] < 0:
-                self.blocked[i] = True
-            elif blocker[2] > world_size - 1:
-                self.blocked[i] = True
-            else:
-                self.blocked[i] = False
-                if contains(*blocker):
-                    self.blocked[i] = True
-            i = i + 1
-            
-class Chunk:
-    def __init__(self, x, z):
-        global textures, world_height, world_min_terrain
-        self.x = x
-        self.z = z
-        self.blocks = []
-        for x in range(0, 16):
-            l = []
-            for y in range(0, world_height):
-                ol = []
-                for z in range(0, 16):
-                    if y < world_min_terrain:
-                        if y == 0:
-                            block = Block(textures["bedrock"])
-                        elif y > 0:
-                            block = Block(textures["stone"])
-                        block.blocked = [True, True, True, True, True, True]
-                    else:
-                        block = Block(textures["default"])
-                        block.air = True
-                    ol.append(block)
-                l.append(ol)
-            self.blocks.append(l)
-        self.display_list = None
-    def add(self, block):
-        self.blocks.append(block)
-    def render(self):
-        global world_height
-        for x in range(0, 16):
-            for y in range(0, world_height):
-                for z in range(0, 16):
-                    self.blocks[x][y][z].render(x + self.x, y, z + self.z)
-            
-def update_neighbors():
-    global chunks, world_height, world_min_terrain, generate_underground
-    for chunk in chunks:
-        for x in range(0, 16):
-            for z in range(0, 16):
-                for y in range(0, world_height):
-                    if not generate_underground and y < world_min_terrain:
-                        continue
-                    if not chunk.blocks[x][y][z].air:
-                        chunk.blocks[x][y][z].update_neighbors(chunk.x + x, y, chunk.z + z)
-            
-def contains(x, y, z):
-    global chunks, world_height
-    for chunk in chunks:
-        if x >= chunk.x and x < chunk.x + 16 and z >= chunk.z and z < chunk.z + 16 and y < world_height and y >= 0:
-            if not chunk.blocks[int(x - chunk.x)][int(y)][int(z - chunk.z)].air:
-                return True
-    return False
+        # the mesh may not be built yet, so the whole column is tested
+        view = frustum.planes(glGetDoublev(GL_PROJECTION_MATRIX), glGetDoublev(GL_MODELVIEW_MATRIX))
+        columns = [(chunk.x, 0, chunk.z, chunk.x + 16, world.height, chunk.z + 16) for distance, chunk, scale in waiting]
+        inside = frustum.inside(view, columns)
+        order = sorted(range(0, len(waiting)), key=lambda i: (int(waiting[i][0]) // 16, not inside[i], waiting[i][0]))
+        built = 0
+        for i in order:
+            distance, chunk, scale = waiting[i]
+            build_chunk_mesh(chunk, scale)
+            built += 1
+            if time.time() - start >= budget:
+                break
+        rebuild_queue = len(waiting) - built
+    else:
+        rebuild_queue = 0
+    rebuild_time = time.time() - start
+    
+def upload_chunk_mesh(chunk, vertices, batches):
+    '''Puts a mesh built by the mesher into the vertex buffer of a chunk.'''
+    
+    global meshes_uploaded
+    
+    meshes_uploaded += 1
+    if chunk.mesh is None:
+        chunk.mesh = glGenBuffers(1)
+    glBindBuffer(GL_ARRAY_BUFFER, chunk.mesh)
+    glBufferData(GL_ARRAY_BUFFER, vertices, GL_STATIC_DRAW)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    chunk.batches = batches
+    chunk.vertex_count = len(vertices)
+    
+    # remembers the box the mesh fits in, for frustum culling
+    if len(vertices) > 0:
+        chunk.bounds = tuple(vertices[:, 0:3].min(axis=0)) + tuple(vertices[:, 0:3].max(axis=0))
+    else:
+        chunk.bounds = None
+    
+def draw_chunk(chunk):
+    '''Draws the vertex buffer of a chunk, one call per texture.
+    Returns the number of draw calls made.'''
+    
+    stride = mesher.vertex_size * 4
+    glBindBuffer(GL_ARRAY_BUFFER, chunk.mesh)
+    glVertexPointer(3, GL_FLOAT, stride, ctypes.c_void_p(0))
+    glTexCoordPointer(2, GL_FLOAT, stride, ctypes.c_void_p(3 * 4))
+    glColorPointer(3, GL_FLOAT, stride, ctypes.c_void_p(5 * 4))
+    for texture_id, first, count in chunk.batches:
+        glBindTexture(GL_TEXTURE_2D, texture_id)
+        glDrawArrays(GL_QUADS, first, count)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    return len(chunk.batches)
+    
+def draw_box(bounds):
+    '''Draws the sides of a box (min x, y, z, max x, y, z).'''
+    
+    global block_vertices, block_faces
+    
+    glBegin(GL_QUADS)
+    for face in block_faces:
+        for corner in face:
+            glVertex3f(*[bounds[axis + 3 * int(block_vertices[corner][axis])] for axis in [0, 1, 2]])
+    glEnd()
     
-def set(x, y, z, new):
-    global chunks, world_height
+def query_occlusion(chunks, frame):
+    '''Asks OpenGL whether any of the box around each chunk would be
+    drawn in front of what has been drawn so far.  The answers are
+    picked up a frame later, so waiting on them never stalls.'''
+    
+    glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+    glDepthMask(GL_FALSE)
+    glDisable(GL_TEXTURE_2D)
+    glDisable(GL_LIGHTING)
     for chunk in chunks:
-        if x >= chunk.x and x < chunk.x + 16 and z >= chunk.z and z < chunk.z + 16 and y < world_height and y >= 0:
-            chunk.blocks[int(x - chunk.x)][int(y)][int(z - chunk.z)] = new
-            return 
+        chunk.queried = frame
+        if chunk.query is None:
+            chunk.query = glGenQueries(1)
+        elif chunk.querying:
             
-def get(x, y, z):
-    global chunks, world_height
-    for chunk in chunks:
-        if x >= chunk.x and x < chunk.x + 16 and z >= chunk.z and z < chunk.z + 16 and y < world_height and y >= 0:
-            return chunk.blocks[int(x - chunk.x)][int(y)][int(z - chunk.z)]
+            # the last answer is still on its way
+            if not glGetQueryObjectiv(chunk.query, GL_QUERY_RESULT_AVAILABLE):
+                continue
+            chunk.occluded = glGetQueryObjectuiv(chunk.query, GL_QUERY_RESULT) == 0
+        glBeginQuery(GL_SAMPLES_PASSED, chunk.query)
+        draw_box(chunk.bounds)
+        glEndQuery(GL_SAMPLES_PASSED)
+        chunk.querying = True
+    glEnable(GL_LIGHTING)
+    glEnable(GL_TEXTURE_2D)
+    glDepthMask(GL_TRUE)
+    glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
             
-
-def destroy(translate, vector, distance=4, accuracy=4):
-    
-    global chunks, world_height, textures, time_passed_seconds, maximum_light
-    
-    xi, yi, zi = vector
-    xi = -xi
-    yi = -yi
-    zi = -zi
-    for i in range(0, distance * accuracy):
-         translate[0] += xi / accuracy
-         translate[1] += yi / accuracy
-         translate[2] += zi / accuracy
-         for chunk in chunks:
-            if int(translate[0]) >= chunk.x and int(translate[0]) < chunk.x + 16 and int(translate[2]) >= chunk.z and int(translate[2]) < chunk.z + 16:
-                for x in range(0, 16):
-                    for y in range(0, world_height):
-                        for z in range(0, 16):
-                            if [chunk.x + x, y, chunk.z + z] == [int(translate[0]), int(translate[1]), int(translate[2])] and not chunk.blocks[x][y][z].air:
-                                if chunk.blocks[x][y][z].texture_ids == textures["bedrock"]:
-                                    return
-                                else:
-                                    chunk.blocks[x][y][z].air = True
-                                    chunk.blocks[x][y][z].light = maximum_light
-                                    if y != world_height - 1:
-                                        chunk.blocks[x][y + 1][z].blocked[5] = False
-                                    if y != 0:
-                                        chunk.blocks[x][y - 1][z].blocked[4] = False
-                                    if x != 15:
-                                        chunk.blocks[x + 1][y][z].blocked[3] = False
-                                    else:
-                                        for other in chunks:
-                                            if chunk.x + 16 == other.x and chunk.z == other.z:
-                                                other.blocks[0][y][z].blocked[3] = False
-                                                other.display_list = None
-                                    if x != 0:
-                                        chunk.blocks[x - 1][y][z].blocked[2] = False
-                                    else:
-                                        for other in chunks:
-                                            if chunk.x - 16 == other.x and chunk.z == other.z:
-                                                other.blocks[15][y][z].blocked[2] = False
-                                                other.display_list = None
-                                    if z != 15:
-                                        chunk.blocks[x][y][z + 1].blocked[1] = False
-                                    else:
-                                        for other in chunks:
-                                            if chunk.x == other.x and chunk.z + 16 == other.z:
-                                                other.blocks[x][y][0].blocked[1] = False
-                                                other.display_list = None
-                                    if z != 0:
-                                        chunk.blocks[x][y][z - 1].blocked[0] = False
-                                    else:
-                                        for other in chunks:
-                                            if chunk.x == other.x and chunk.z - 16 == other.z:
-                                                other.blocks[x][y][15].blocked[0] = False
-                                                other.display_list = None
-                                    chunk.display_list = None
-                                    return
-                                
-def place(translate, vector, distance=4, accuracy=4):
-    
-    global chunks, world_height, textures
-    
-    original = list(translate)
-    
-    xi, yi, zi = vector
-    xi = -xi
-    yi = -yi
-    zi = -zi
-    for i in range(0, distance * accuracy):
-         translate[0] += xi / accuracy
-         translate[1] += yi / accuracy
-         translate[2] += zi / accuracy
-         for chunk in chunks:
-            if int(translate[0]) >= chunk.x and int(translate[0]) < chunk.x + 16 and int(translate[2]) >= chunk.z and int(translate[2]) < chunk.z + 16:
-                for x in range(0, 16):
-                    for y in range(0, world_height):
-                        for z in range(0, 16):
-                            if [chunk.x + x, y, chunk.z + z] == [int(translate[0]), int(translate[1]), int(translate[2])] and not chunk.blocks[x][y][z].air and y != world_height - 1:
-                                translate[0] -= xi / accuracy
-                                translate[1] -= yi / accuracy
-                                translate[2] -= zi / accuracy
-                                block = chunk.blocks[x][y][z]
-                                closest_normal = None
-                                for normal in block_normals:
-                                    position = [chunk.x + x + 0.5, y + 0.5, chunk.z + z + 0.5]
-                                    for i in [0, 1, 2]:
-                                        position[i] += normal[i] / 2
-                                    dist = math.sqrt((position[0] - translate[0])**2 + (position[1] - translate[1])**2 + (position[2] - translate[2])**2)
-                                    if closest_normal is None:
-                                        closest_normal = block_normals.index(normal)
-                                        closest_inormal = block_normals.index((-normal[0], -normal[1], -normal[2]))
-                                        closest_dist = dist
-                                    else:
-                                        if dist < closest_dist:
-                                            closest_normal = block_normals.index(normal)
-                                            closest_inormal = block_normals.index((-normal[0], -normal[1], -normal[2]))
-                                            closest_dist = dist
-                                new_position = [int(x + block_normals[closest_normal][0]), int(y + block_normals[closest_normal][1]), int(z + block_normals[closest_normal][2])]
-                                #if original[0] - 0.3 <= new_position[0] + chunk.x + 1 and original[0] + 0.3 >= chunk.x + new_position[0] and original[1] - 1.2 <= new_position[1] + 1 and original[1] + 0.3 >= new_position[1] and original[2] - 0.3 <= chunk.z + new_position[2] + 1 and original[1] + 0.3 >= chunk.z + new_position[2]:
-                                    #return
-                                if new_position[0] >= 0 and new_position[0] < 16 and new_position[1] >= 0 and new_position[1] < world_height and new_position[2] >= 0 and new_position[2] < 16:
-                                    chunk.blocks[int(new_position[0])][int(new_position[1])][int(new_position[2])] = Block(textures["brick"])
-                                    chunk.display_list = None
-                                    #for normal in chunk.blocks[int(new_position[0])][int(new_position[1])][int(new_position[2])].normals:
-                                      #  chunk.blocks[int(new_position[0] + normal[0])][int(new_position[1] + normal[1])][int(new_position[2] + normal[2])].update_neighbors(int(new_position[0] + normal[0]), int(new_position[1] + normal[1]), int(new_position[2] + normal[2]))
-                                else:
-                                    if new_position[0] < 0:
-                                        for other in chunks:
-                                            if chunk.x == other.x + 16 and chunk.z == other.z:
-                                                new_position[0] = 15
-                                                other.display_list = None
-                                                #for normal in other.blocks[int(new_position[0])][int(new_position[1])][int(new_position[2])].normals:
-                                                #    other.blocks[int(new_position[0] + normal[0])][int(new_position[1] + normal[1])][int(new_position[2] + normal[2])].update_neighbors(int(new_position[0] + normal[0]), int(new_position[1] + normal[1]), int(new_position[2] + normal[2]))
-                                                break
-                                    elif new_position[0] >= 16:
-                                        for other in chunks:
-                                            if chunk.x == other.x - 16 and chunk.z == other.z:
-                                                new_position[0] = 0
-                                                other.display_list = None
-                                                #for normal in other.blocks[int(new_position[0])][int(new_position[1])][int(new_position[2])].normals:
-                                                #    other.blocks[int(new_position[0] + normal[0])][int(new_position[1] + normal[1])][int(new_position[2] + normal[2])].update_neighbors(int(new_position[0] + normal[0]), int(new_position[1] + normal[1]), int(new_position[2] + normal[2]))
-                                                break
-                                    elif new_position[1] < 0:
-                                        for other in chunks:
-                                            if chunk.x == other.x and chunk.z == other.z + 16:
-                                                new_position[1] = 15
-                                                other.display_list = None
-                                                #for normal in other.blocks[int(new_position[0])][int(new_position[1])][int(new_position[2])].normals:
-                                                 #   other.blocks[int(new_position[0] + normal[0])][int(new_position[1] + normal[1])][int(new_position[2] + normal[2])].update_neighbors(int(new_position[0] + normal[0]), int(new_position[1] + normal[1]), int(new_position[2] + normal[2]))
-                                                break
-                                    elif new_position[1] >= 16:
-                                        for other in chunks:
-                                            if chunk.x == other.x and chunk.z == other.z - 16:
-                                                new_position[1] = 0
-                                                other.display_list = None
-                                                #for normal in other.blocks[int(new_position[0])][int(new_position[1])][int(new_position[2])].normals:
-                                                 #   other.blocks[int(new_position[0] + normal[0])][int(new_position[1] + normal[1])][int(new_position[2] + normal[2])].update_neighbors(int(new_position[0] + normal[0]), int(new_position[1] + normal[1]), int(new_position[2] + normal[2]))                            
-                                                break      
-                                    else:
-                                        return
-                                    other.blocks[int(new_position[0])][int(new_position[1])][int(new_position[2])] = Block(textures["brick"], 15)
-                                    
-                                return
+def destroy(translate, vector, distance=4):
+    
+    global world
+    
+    hit = world.raycast(translate, [-vector[0], -vector[1], -vector[2]], distance)
+    if hit is None:
+        return
+    x, y, z = hit[0]
+    if not world.breakable(x, y, z):
+        return
+    world.change(x, y, z, AIR)
+    world.chunk_at(x, z).modified = True
+    world.chunk_at(x, z).unsaved = True
                                 
-                                    
-                                '''chunk.blocks[x][y + 1][z] = Block(textures["brick"])
-                                chunk.blocks[x][y + 1][z].blocked[5] = True
-                                chunk.blocks[x][y][z].blocked[4] = True
-                                if y != world_height - 2:
-                                    if not chunk.blocks[x][y + 2][z].air:
-                                        chunk.blocks[x][y + 1][z].blocked[4] = True
-                                        chunk.blocks[x][y + 2][z].blocked[5] = True
-                                if x != 15:
-                                    if not chunk.blocks[x + 1][y + 1][z].air:
-                                        chunk.blocks[x][y + 1][z].blocked[2] = True
-                                        chunk.blocks[x + 1][y + 1][z].blocked[3] = True
-                                else:
-                                    for other in chunks:
-                                        if chunk.x + 16 == other.x and chunk.z == other.z:
-                                            if not chunk.blocks[0][y + 1][z].air:
-                                                chunk.blocks[x][y + 1][z].blocked[2] = True
-                                                other.blocks[0][y + 1][z].blocked[3] = True
-                                                other.display_list = None
-                                if x != 0:
-                                    if not chunk.blocks[x - 1][y + 1][z].air:
-                                        chunk.blocks[x][y + 1][z].blocked[3] = True
-                                        chunk.blocks[x - 1][y + 1][z].blocked[2] = True
-                                else:
-                                    for other in chunks:
-                                        if chunk.x - 16 == other.x and chunk.z == other.z:
-                                            if not chunk.blocks[15][y + 1][z].air:
-                                                chunk.blocks[x][y + 1][z].blocked[3] = True
-                                                other.blocks[15][y + 1][z].blocked[2] = True
-                                                other.display_list = None
-                                if z != 15:
-                                    if not chunk.blocks[x][y + 1][z + 1].air:
-                                        chunk.blocks[x][y + 1][z].blocked[0] = True
-                                        chunk.blocks[x][y + 1][z + 1].blocked[1] = True
-                                else:
-                                    for other in chunks:
-                                        if chunk.x == other.x and chunk.z + 16 == other.z:
-                                            if not chunk.blocks[x][y + 1][0].air:
-                                                chunk.blocks[x][y + 1][z].blocked[0] = True
-                                                other.blocks[x][y + 1][0].blocked[1] = True
-                                                other.display_list = None
-                                if z != 0:
-                                    if not chunk.blocks[x][y + 1][z - 1].air:
-                                        chunk.blocks[x][y + 1][z].blocked[1] = True
-                                        chunk.blocks[x][y + 1][z - 1].blocked[0] = True
-                                else:
-                                    for other in chunks:
-                                        if chunk.x == other.x and chunk.z - 16 == other.z:
-                                            if not chunk.blocks[x][y + 1][15].air:
-                                                chunk.blocks[x][y + 1][z].blocked[1] = True
-                                                other.blocks[x][y + 1][15].blocked[0] = True
-                                                other.display_list = None
-                                chunk.display_list = None
-                                return'''
-                                
-def collide(min_x, min_y, min_z, max_x, max_y, max_z):
-    '''This function checks to see if this object collides with anything.'''
-    
-    global chuncks, world_height
-        
-    for chunk in chunks:
-        if max_x >= chunk.x and min_x < chunk.x + 16 and max_z >= chunk.z and min_z < chunk.z + 16:
-            for x in range(0, 16):
-                for y in range(0, world_height):
-                    for z in range(0, 16):
-                        if min_x <= chunk.x + x + 1 and max_x >= chunk.x + x and min_y <= y + 1 and max_y >= y and min_z <= chunk.z + z + 1 and max_z >= chunk.z + z and not chunk.blocks[x][y][z].air:
-                            return True
-    return False
-        
-def generate_tree(x, y, z):
-    global world_size, textures
-    height = random.randint(3, 5)
-    for i in range(y, y + height):
-        new = Block(textures["tree"])
-        set(x, i, z, new) 
-    for i in [x - 1, x, x + 1]:
-        for j in [y + height - 1, y + height]:
-            for k in [z - 1, z, z + 1]:
-                if i != x or k != z or j == y + height:
-                    new = Block(textures["leaf"])
-                    set(i, j, k, new) 
-                    
-def noise(x, y):
-    global seeds
-    return seeds[9][x][y]
-    x += 10000
-    y += 10000
-    global seed
-    return ((int(seed * (x << 7) * x**2) % 100) + (int((seed * 3.728463635) * (y << 9) * y**3) % 100)) / 200.0
-    
-def smooth_noise(x, y):
-    global world_size
-    return noise(x, y)
-    corners = 0
-    sides = 0
-    if x > 0 and y > 0:
-        corners += noise(x - 1, y - 1)
-    if x < world_size and y > 0:
-        corners += noise(x + 1, y - 1)
-    if x > 0 and y < world_size:
-        corners += noise(x - 1, y + 1)
-    if x < world_size and y < world_size:
-        corners += noise(x + 1, y + 1)
-    if x > 0:
-        sides += noise(x - 1, y)
-    if x < world_size:
-        sides += noise(x + 1, y)
-    if y > 0:
-        sides += noise(x, y - 1)
-    if y < world_size:
-        sides += noise(x, y + 1)
-    corners /= 16
-    sides /= 8
-    center = noise(x, y) / 4
-    return corners + sides + center
-    
-def interpolate(a, b, x):
-    ft = x * 3.1415927
-    f = (1.0 - math.cos(ft)) * 0.5
-    return float(a * (1.0 - f) + b * f)
-    
-def interpolated_noise(x, y):
-    global world_size
-
-    integer_x    = int(x)
-    fractional_x = x - integer_x
+def place(translate, vector, distance=4):
     
-    integer_y    = int(y)
-    fractional_y = y - integer_y
+    global world, world_height
     
-    v1 = smooth_noise(integer_x, integer_y)
-    v2 = smooth_noise(integer_x + 1, integer_y)
-    v3 = smooth_noise(integer_x, integer_y + 1)
-    v4 = smooth_noise(integer_x + 1, integer_y + 1)
+    hit = world.raycast(translate, [-vector[0], -vector[1], -vector[2]], distance)
+    if hit is None or hit[2] is None or hit[0][1] == world_height - 1:
+        return
+    new_position = hit[2]
+            
+    # the new block may end up in a neighboring chunk
+    chunk = world.chunk_at(new_position[0], new_position[2])
+    if chunk is not None and new_position[1] >= 0 and new_position[1] < world_height:
+        world.change(new_position[0], new_position[1], new_position[2], blocks.BRICK)
+        chunk.modified = True
+        chunk.unsaved = True
+                                
+def draw_highlight(x, y, z):
+    '''Outlines the block at x, y, z.'''
     
-    i1 = interpolate(v1, v2, fractional_x)
-    i2 = interpolate(v3, v4, fractional_x)
+    global block_vertices, block_faces
     
-    return interpolate(i1 , i2 , fractional_y)
-                    
-def perlin_noise(x, y):
-    global world_size
-    return interpolated_noise(x / 32.0, y / 32.0)
-    average = 0
-    octaves = 6
-    amplitude = 0.6
-    frequency = (1 / (100))
-    for i in range(0, octaves):
-        average += amplitude * interpolated_noise(x * frequency, y * frequency)
-        frequency *= 2
-        amplitude /= 2
-    return average
-                    
-def generate_terrain():
-    global world_size, textures, world_height, world_min_terrain, world_max_terrain, generate_underground, world_water_level
-    trees = []
-    for i in range(1, (world_size / 16)**2):
-        trees.append([random.randint(2, world_size - 3), 0, random.randint(2, world_size - 3)])
-    for x in range(0, world_size):
-        for z in range(0, world_size):
-            height = world_min_terrain + (int(perlin_noise(x, z) * (world_max_terrain - world_min_terrain)))
-            for y in range(world_min_terrain, height + 1):
-                if y == height:
-                    if y > world_water_level:
-                        texture = textures["grass"]
-                    else:
-                        texture = textures["sand"]
-                if y < height:
-                    texture = textures["dirt"]
-                if y < height - 2:
-                    texture = textures["stone"]
-                new = Block(texture)
-                set(x, y, z, new)  
-            for tree in trees:
-                if tree[0] == x and tree[2] == z:
-                    tree[1] = height + 1
-    for chunkx in range(0, world_size, 16):
-        for chunkz in range(0, world_size, 16):
-            amount = random.randint(5, 8)
-            for i in range(0, amount):
-                x = random.randint(chunkx, chunkx + 16)
-                y = random.randint(1, world_min_terrain - 1)
-                z = random.randint(chunkz, chunkz + 16)
-                if x == 0:
-                    x += 1
-                if x == world_size - 1:
-                    x -= 1
-                if z == 0:
-                    z += 1
-                if z == world_size - 1:
-                    z -= 1
-                if y == 0:
-                    y += 1
-                new = Block(textures["iron"])
-                new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                set(x, y, z, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]   
-                    set(x - 1, y, z, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x + 1, y, z, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x, y - 1, z, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x, y + 1, z, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x, y, z - 1, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x, y, z + 1, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x - 1, y - 1, z - 1, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x + 1, y - 1, z - 1, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x - 1, y - 1, z + 1, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x + 1, y - 1, z + 1, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x - 1, y + 1, z - 1, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x + 1, y + 1, z - 1, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x - 1, y + 1, z + 1, new)
-                if random.choice([True, False]):
-                    new = Block(textures["iron"])
-                    new.blocked = [
-                    True,
-                    True,
-                    True,
-                    True,
-                    True,
-                    True
-                    ]  
-                    set(x + 1, y + 1, z + 1, new)
-                
-    if generate_underground:
-        threshold = 0.53
-        for x in range(1, world_size - 1):
-            for y in range(2, world_height):
-                for z in range(1, world_size - 1):
-                    if not get(x, y, z).air:
-                        value = perlin_noise_3d(x, y, z)
-                        if value > threshold:
-                            new = Block()
-                            new.air = True
-                            set(x, y, z, new)
-    
-    for tree in trees:
-        if contains(tree[0], tree[1] - 1, tree[2]):
-            make = True
-            if tree[1] < world_water_level:
-                make = False
-            others = list(trees)
-            others.remove(tree)
-            for other in others:
-                if other[0] > tree[0] - 3 and other[0] < tree[0] + 3 and other[2] > tree[2] - 3 and other[2] < tree[2] + 3:
-                    make = False
-            if make:
-                generate_tree(*tree)
+    glDisable(GL_TEXTURE_2D)
+    glDisable(GL_LIGHTING)
+    glColor(0.0, 0.0, 0.0)
+    for face in block_faces:
+        glBegin(GL_LINE_LOOP)
+        for corner in face:
             
-def noise_3d(x, y, z):
-    global seeds
-    return seeds[x][y][z]
-    x += 10000
-    y += 10000
-    z += 10000
-    global seed
-    return ((int(seed * (x << 7) * x**2) + int((seed * 3.728463635) * (y << 9) * y**3) + int((seed * 5.61368952) * (z << 5) * z**(3/2))) % 100) / 100.0
-    
-def smooth_noise_3d(x, y, z):
-    global world_size, world_height
-    corners = 0
-    sides = 0
-    if x > 0 and y > 0 and z > 0:
-        corners += noise_3d(x - 1, y - 1, z - 1)
-    if x > 0 and y > 0 and z < world_size:
-        corners += noise_3d(x - 1, y - 1, z + 1)
-    if x < world_size and y > 0 and z > 0:
-        corners += noise_3d(x + 1, y - 1, z - 1)
-    if x < world_size and y > 0 and z < world_size:
-        corners += noise_3d(x + 1, y - 1, z + 1)
-    if x > 0 and y < world_size and z > 0:
-        corners += noise_3d(x - 1, y + 1, z - 1)
-    if x > 0 and y < world_size and z < world_size:
-        corners += noise_3d(x - 1, y + 1, z + 1)
-    if x < world_size and y < world_size and z > 0:
-        corners += noise_3d(x + 1, y + 1, z - 1)
-    if x < world_size and y < world_size and z < world_size:
-        corners += noise_3d(x + 1, y + 1, z + 1)
-    if x > 0:
-        sides += noise_3d(x - 1, y, z)
-    if x < world_size:
-        sides += noise_3d(x + 1, y, z)
-    if y > 0:
-        sides += noise_3d(x, y - 1, z)
-    if y < world_size:
-        sides += noise_3d(x, y + 1, z)
-    if z > 0:
-        sides += noise_3d(x, y, z - 1) 
-    if z < world_size:
-        sides += noise_3d(x, y, z + 1)
-    corners *= (10.0 / 8.0) / 16.0
-    sides *= (2.0 / 6.0) / 16.0
-    center = noise_3d(x, y, z) / 4
-    return corners + sides + center
-    
-def interpolated_noise_3d(x, y, z):
-
-    integer_x    = int(x)
-    fractional_x = x - integer_x
+            # pushes the outline slightly out so the block does not hide it
+            vx, vy, vz = block_vertices[corner]
+            glVertex(x + (vx - 0.5) * 1.002 + 0.5, y + (vy - 0.5) * 1.002 + 0.5, z + (vz - 0.5) * 1.002 + 0.5)
+        glEnd()
+    glColor(1.0, 1.0, 1.0)
+    glEnable(GL_LIGHTING)
+    glEnable(GL_TEXTURE_2D)
+                                
+def quit():
+    '''Saves the chunks the player changed and leaves the game.'''
     
-    integer_y    = int(y)
-    fractional_y = y - integer_y
+    global streamer, world, store
     
-    integer_z    = int(z)
-    fractional_z = z - integer_z
-
-    v1 = smooth_noise_3d(integer_x, integer_y, integer_z)
-    v2 = smooth_noise_3d(integer_x + 1, integer_y, integer_z)
-    v3 = smooth_noise_3d(integer_x, integer_y + 1, integer_z)
-    v4 = smooth_noise_3d(integer_x + 1, integer_y + 1, integer_z)
-    i1 = interpolate(v1, v2, fractional_x)
-    i2 = interpolate(v3, v4, fractional_x)
-    left = interpolate(i1, i2, fractional_y)
-    
-    v1 = smooth_noise_3d(integer_x, integer_y, integer_z + 1)
-    v2 = smooth_noise_3d(integer_x + 1, integer_y, integer_z + 1)
-    v3 = smooth_noise_3d(integer_x, integer_y + 1, integer_z + 1)
-    v4 = smooth_noise_3d(integer_x + 1, integer_y + 1, integer_z + 1)
-    i1 = interpolate(v1, v2, fractional_x)
-    i2 = interpolate(v3, v4, fractional_x)
-    right = interpolate(i1, i2, fractional_y)
-    
-    return interpolate(left, right, fractional_z)
-            
-def perlin_noise_3d(x, y, z):
-    #return interpolated_noise_3d(x / 8.0, y / 8.0, z / 8.0)
-    global world_size
-    average = 0
-    octaves = [32, 16, 8, 4]
-    for i in octaves:
-        average += interpolated_noise_3d(x / float(i), y / float(i), z / float(i)) / float(len(octaves))
-    # print average
-    return average
-                    
-def dot_product(a, b):
-    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+    if streamer is not None:
+        streamer.close()
+    else:
+        save_chunks(world, store)
+        store.close()
+    sys.exit()
 
 def runtime(function, args=[]):
     start = time.time()
     function(*args)
     return time.time() - start
     
-def generate_chunks():
-    global chunks, world_size
-    for x in range(0, world_size, 16):
-        for z in range(0, world_size, 16):
-            chunks.append(Chunk(x, z))
-            
-def get_color(x, y, z, normal):
-    global minimum_light, maximum_light
-    l = 0
-    n = 0
-    for xi in [x, x - 1]:
-        if normal[0] == 1 and xi == x or normal[0] == -1 and xi == x - 1 or normal[0] == 0:
-            for yi in [y, y - 1]:
-                if normal[1] == 1 and yi == y or normal[1] == -1 and yi == y - 1 or normal[1] == 0:
-                    for zi in [z, z - 1]:
-                        if normal[2] == 1 and zi == z or normal[2] == -1 and zi == z - 1 or normal[2] == 0:
-                            block = get(xi, yi, zi)
-                            if block != None:
-                                l += block.light
-                                n += 1
-    if l != 0:
-        l /= float(n)
-    return (l / float(maximum_light), l / float(maximum_light), l / float(maximum_light))
-            
-def generate_light(x=0, y=0, z=0):
-    global minimum_light, maximum_light
-    '''chunkx = x / 16
-    chunkz = z / 16
-    x = x % 16
-    z = z % 16
-    b = chunk.blocks[x][y][z]
-    for chunk in chunks:
-        if chunk.x == chunkx and chunk.z == chunkz:
-            b = chunk.blocks[x][y][z]
-            if not b.air:
-                continue'''
-            
-
-    for chunk in chunks:
-        for y in range(world_height - 1, -1, -1):
-            for x in range(0, 16):
-                for z in range(0, 16):
-                    b = chunk.blocks[x][y][z]
-                    if not b.air:
-                        continue
-                    chunk.blocks[x][y][z].light = maximum_light
-                    '''exposed = True
-                    for i in range(y + 1, world_height):
-                        if contains(x + chunk.x, i, z + chunk.z):
-                            exposed = False
-                            break;
-                    if exposed:
-                        chunk.blocks[x][y][z].light = maximum_light
-                    else:
-                        global world_size, block_normals
-            
-                        best = 0
-                        for normal in block_normals:
-                            blocker = [x + chunk.x, y, z + chunk.z]
-                            blocker[0] += normal[0]
-                            blocker[1] += normal[1]
-                            blocker[2] += normal[2]
-                            b = get(*blocker)
-                            if b != None:
-                                l = b.light
-                                if l > best:
-                                    best = l
-                        if best == minimum_light:
-                            best = minimum_light + 1
-                        chunk.blocks[x][y][z].light = best - 1'''
-    
-                        
-# world properties
-world_size = input("World's Size? >>> ")
-world_height = input("World's Height? >>> ")
-world_min_terrain = input("World's Minimum Terrain Height? >>> ")
-world_water_level = input("World's Water Level? >>> ")
-world_max_terrain = world_height - 8
-generate_underground = raw_input("Generate Underground Caves? (y/n) >>> ")
-
-'''world_size = 80
-world_height = 32
-world_min_terrain = 5
-world_water_level = 8.8
-world_max_terrain = world_height - 8
-generate_underground = "n"'''
-print
-if generate_underground != "n":
-    generate_underground = True
+# every world is saved under its name, and a saved world is made
+# with the same properties it was first made with
+world_name = raw_input("World's Name? >>> ")
+world_directory = os.path.join("saves", world_name)
+level = load_level(world_directory)
+if level is not None:
+    infinite_terrain = level["infinite_terrain"]
+    world_size = level["size"]
+    world_height = level["height"]
+    world_min_terrain = level["min_terrain"]
+    world_water_level = level["water_level"]
+    world_seed = level["seed"]
+    world_max_terrain = level["max_terrain"]
+    generate_underground = level["generate_underground"]
 else:
-    generate_underground = False
+    
+    # world properties
+    infinite_terrain = raw_input("Infinite Terrain? (y/n) >>> ")
+    if infinite_terrain != "n":
+        infinite_terrain = True
+        
+        # big enough that nobody walks off the edge, small enough that
+        # the vertex positions keep their precision
+        world_size = 1 << 16
+    else:
+        infinite_terrain = False
+        world_size = input("World's Size? >>> ")
+    world_height = input("World's Height? >>> ")
+    world_min_terrain = input("World's Minimum Terrain Height? >>> ")
+    world_water_level = input("World's Water Level? >>> ")
+    world_seed = input("World's Seed? >>> ")
+    world_max_terrain = world_height - 8
+    generate_underground = raw_input("Generate Underground Caves? (y/n) >>> ")
+    
+    '''infinite_terrain = False
+    world_size = 80
+    world_height = 32
+    world_min_terrain = 5
+    world_water_level = 8.8
+    world_seed = 0
+    world_max_terrain = world_height - 8
+    generate_underground = "n"'''
+    if generate_underground != "n":
+        generate_underground = True
+    else:
+        generate_underground = False
+        
+# a finite world can start as soon as the ground around the player
+# is ready, filling in the rest while the game runs; a world the game
+# stopped saving part way through always carries on that way
+progressive_startup = False
+if level is not None and not level.get("complete", True):
+    progressive_startup = not infinite_terrain
+elif not infinite_terrain:
+    progressive_startup = raw_input("Progressive Startup? (y/n) >>> ") != "n"
+print
     
 # sets up everything
 pygame.init()
@@ -1038,16 +437,6 @@ pygame.mouse.set_visible(False)
 glLoadMatrixd(camera_matrix.get_inverse().to_opengl())
 
 # block information
-block_vertices = [ 
-    [0.0, 0.0, 1.0],
-    [1.0, 0.0, 1.0],
-    [1.0, 1.0, 1.0],
-    [0.0, 1.0, 1.0],
-    [0.0, 0.0, 0.0],
-    [1.0, 0.0, 0.0],
-    [1.0, 1.0, 0.0],
-    [0.0, 1.0, 0.0] 
-]
 block_normals = [ 
     (0.0, 0.0, +1.0),  # front
     (0.0, 0.0, -1.0),  # back
@@ -1055,12 +444,6 @@ block_normals = [
     (-1.0, 0.0, 0.0),  # left 
     (0.0, +1.0, 0.0),  # top
     (0.0, -1.0, 0.0) ] # bottom
-block_faces = [ (0, 1, 2, 3),
-    (4, 5, 6, 7),  # back
-    (1, 5, 6, 2),  # right
-    (0, 4, 7, 3),  # left
-    (3, 2, 6, 7),  # top
-    (0, 1, 5, 4) ] # bottom  
     
 sun = [0, 0, 1]
 minimum_light = 5
@@ -1081,80 +464,188 @@ time_passed_seconds = 0
 space = 0
 focus = False
 view_distance = 40
-chunks = []
+greedy_meshing = False
 
-seeds = []
-for x in range(0, world_size):
-    i = []
-    for y in range(0, world_height):
-        j = []
-        for z in range(0, world_size):
-            j.append(random.uniform(0, 1))
-        i.append(j)
-    seeds.append(i)
+# distant chunks are meshed from bigger blocks, out past each of
+# these distances (see mesher.py)
+lod_distances = mesher.lod_distances
 
-# loads all textures
-load_texture("textures/default.png")
-load_texture("textures/stone.png")
-load_texture("textures/grass_side.png")
-load_texture("textures/grass_top.png")
-load_texture("textures/dirt.png")
-load_texture("textures/tree_middle.png")
-load_texture("textures/tree_side.png")
-load_texture("textures/leaves.png")
-load_texture("textures/bedrock.png")
-load_texture("textures/brick.png")
-load_texture("textures/sky box/side.png")
-load_texture("textures/sky box/top.png")
-load_texture("textures/sky box/bottom.png")
-load_texture("textures/sky box/sun.png")
-load_texture("textures/iron.png")
-load_texture("textures/sand.png")
-load_texture("textures/water.png")
-textures = {"default":[1, 1, 1, 1, 1, 1],
-            "bedrock":[9, 9, 9, 9, 9, 9],
-            "stone":[2, 2, 2, 2, 2, 2],
-            "grass":[3, 3, 3, 3, 4, 5],
-            "dirt":[5, 5, 5, 5, 5, 5],
-            "tree":[7, 7, 7, 7, 6, 6],
-            "leaf":[8, 8, 8, 8, 8, 8],
-            "brick":[10, 10, 10, 10, 10, 10],
-            "skybox":[14, 11, 11, 11, 12, 13],
-            "iron":[15, 15, 15, 15, 15, 15],
-            "sand":[16, 16, 16, 16, 16, 16]}
+# hides chunks that are buried or behind other chunks, counting
+# how much is drawn each frame so the difference can be seen
+occlusion_culling = False
+draw_calls = 0
+chunks_drawn = 0
+meshes_uploaded = 0
+visibility_key = None
+reachable = None
+
+# seconds each frame may spend uploading streamed chunk meshes
+upload_budget = 0.004
+
+# seconds each frame may spend rebuilding chunk meshes, how many
+# chunks were left waiting for a new mesh and how long it took
+rebuild_budget = 0.008
+rebuild_queue = 0
+rebuild_time = 0
+
+# keeps the block ids of chunks palette packed (see sections.py),
+# or as runs down each column for very tall worlds (see columns.py)
+packed_blocks = True
+column_blocks = False
+
+# seconds between saves of the chunks the player changed
+autosave_delay = 30
+autosave_count = 0
+
+# when the game started, how long until the first frame with the
+# world in it was drawn and whether the whole world is in yet
+startup = time.time()
+first_frame = None
+world_filled = False
+
+# counts the frames drawn, so occlusion answers from frames a chunk
+# was not asked about can be told apart
+frame = 0
+
+# the same seed always makes the same world
+terrain = Terrain(world_seed, world_size, world_height, world_min_terrain, world_max_terrain, world_water_level, generate_underground)
+
+# worker processes generate the chunks; where they are spawned rather
+# than forked each one would run this whole script again, so there the
+# chunks are generated here instead
+if sys.platform == "win32":
+    generation_processes = 1
+else:
+    generation_processes = None
+
+# loads all textures, their ids count up from 1 in this order
+texture_files = ["textures/default.png",
+                 "textures/stone.png",
+                 "textures/grass_side.png",
+                 "textures/grass_top.png",
+                 "textures/dirt.png",
+                 "textures/tree_middle.png",
+                 "textures/tree_side.png",
+                 "textures/leaves.png",
+                 "textures/bedrock.png",
+                 "textures/brick.png",
+                 "textures/sky box/side.png",
+                 "textures/sky box/top.png",
+                 "textures/sky box/bottom.png",
+                 "textures/sky box/sun.png",
+                 "textures/iron.png",
+                 "textures/sand.png",
+                 "textures/water.png"]
+for texture_file in texture_files:
+    load_texture(texture_file)
+
+# the skybox is the only thing drawn with textures that are not the
+# faces of a block type (see blocks.py)
+skybox_textures = [14, 11, 11, 11, 12, 13]
+            
+# packs every texture in use into one atlas
+atlas_files = {}
+for texture_ids in [block_type.texture_ids for block_type in block_types] + [skybox_textures]:
+    for texture_id in texture_ids:
+        atlas_files[texture_id] = texture_files[texture_id - 1]
+atlas = Atlas(atlas_files)
+atlas.texture_id = upload_texture(atlas.surface, GL_CLAMP_TO_EDGE)
             
 # creates a skybox
-skybox = SkyBox(textures["skybox"])
+skybox = SkyBox(skybox_textures, atlas)
+
+# creates the world
+world = World(world_size, world_height, world_min_terrain, generate_underground, maximum_light, minimum_light,
+              packed_blocks, column_blocks)
         
-# creates world
-total = 0
-print "Creating world chunks..."
-run = runtime(generate_chunks)
-total += run
-print("Completed in %.2f seconds.\n" % run)
-print "Generating world terrain..."
-run = runtime(generate_terrain)
-total += run
-print ("Completed in %.2f seconds.\n" % run)
-print "Updating block neighbor flags..."
-run = runtime(update_neighbors)
-total += run
-print ("Completed in %.2f seconds.\n" % run)
-print "Generating lighting..."
-run = runtime(generate_light)
-total += run
-print ("Completed in %.2f seconds.\n" % run)
-print ("All world generation completed in %.2f seconds." % total)
-print "Starting game...\n"
+# opens the save of the world
+store = RegionStore(world_directory, world_height, packed_blocks, column_blocks)
+
+# the settings are written once the whole world has been saved, or,
+# for a world streamed in, before its first chunk is saved, marking it
+# complete only once every chunk of it has been
+level_settings = {"infinite_terrain": infinite_terrain,
+                  "size": world_size,
+                  "height": world_height,
+                  "min_terrain": world_min_terrain,
+                  "water_level": world_water_level,
+                  "seed": world_seed,
+                  "max_terrain": world_max_terrain,
+                  "generate_underground": generate_underground,
+                  "complete": level is not None and level.get("complete", True)}
+if level is None and (infinite_terrain or progressive_startup):
+    save_level(world_directory, level_settings)
+
+# an infinite world is streamed in around the player as they go,
+# keeping no more than max_chunks loaded at once
+max_chunks = 1024
+if infinite_terrain:
+    streamer = Streamer(world, terrain, generation_processes, atlas, greedy_meshing, store=store, max_chunks=max_chunks,
+                        lod_distances=lod_distances)
+    translate = [world_size / 2 + 8, world_height + 2, world_size / 2 + 8]
+    print "Starting game...\n"
+elif progressive_startup:
+    
+    # streams the whole world in, nearest the player first
+    streamer = Streamer(world, terrain, generation_processes, atlas, greedy_meshing, store=store,
+                        lod_distances=lod_distances, fill=True)
+    print "Starting game...\n"
+elif level is not None:
+    streamer = None
+    
+    # loads the saved world
+    total = 0
+    print "Loading world..."
+    run = runtime(load_world, [world, store, terrain])
+    total += run
+    print ("Completed in %.2f seconds.\n" % run)
+    
+    # fills in the store when chunks were missing from it
+    if [chunk for chunk in world.chunks.values() if chunk.unsaved]:
+        print "Saving the chunks missing from the world..."
+        run = runtime(save_chunks, [world, store])
+        total += run
+        print ("Completed in %.2f seconds.\n" % run)
+    print "Updating block neighbor flags..."
+    run = runtime(world.update_neighbors)
+    total += run
+    print ("Completed in %.2f seconds.\n" % run)
+    print ("World loaded in %.2f seconds." % total)
+    print "Starting game...\n"
+else:
+    streamer = None
+    
+    # creates world
+    total = 0
+    print "Generating world terrain..."
+    run = runtime(generate_world, [world, terrain, generation_processes])
+    total += run
+    print ("Completed in %.2f seconds.\n" % run)
+    print "Updating block neighbor flags..."
+    run = runtime(world.update_neighbors)
+    total += run
+    print ("Completed in %.2f seconds.\n" % run)
+    print "Generating lighting..."
+    run = runtime(world.generate_light)
+    total += run
+    print ("Completed in %.2f seconds.\n" % run)
+    print "Saving world..."
+    run = runtime(save_chunks, [world, store, list(world.chunks.values())])
+    total += run
+    print ("Completed in %.2f seconds.\n" % run)
+    level_settings["complete"] = True
+    save_level(world_directory, level_settings)
+    print ("All world generation completed in %.2f seconds." % total)
+    print "Starting game...\n"
 
 
 # starts the main loop
 while True:
     for event in pygame.event.get():
         if event.type == QUIT:
-            sys.exit()
+            quit()
         if event.type == KEYUP and event.key == K_ESCAPE:
-            sys.exit()
+            quit()
         if event.type == pygame.MOUSEBUTTONDOWN:
             if event.button == 1:
                 x, y, z, n = camera_matrix.forward
@@ -1191,14 +682,58 @@ while True:
                 view_distance += 5
             if event.key == K_p:
                 fps = 1.0 / time_passed_seconds
-                print("Running at %.2f fps." % fps)
+                vertices = sum([chunk.vertex_count for chunk in world.chunks.values()])
+                print("Running at %.2f fps (%.2f ms a frame), %d vertices." % (fps, time_passed_seconds * 1000, vertices))
+                print("%d chunks drawn with %d draw calls, occlusion culling %s." % (chunks_drawn, draw_calls, ["off", "on"][occlusion_culling]))
+                chunk_bytes = sum([chunk.nbytes() for chunk in world.chunks.values()])
+                dense_bytes = sum([chunk.dense_nbytes() for chunk in world.chunks.values()])
+                print("Block data takes %.1f KB a chunk, %.1f KB as plain arrays." % (chunk_bytes / 1024.0 / max(len(world.chunks), 1),
+                                                                                      dense_bytes / 1024.0 / max(len(world.chunks), 1)))
+                if streamer is None:
+                    print("%d chunks waiting for a new mesh, %.2f ms spent rebuilding." % (rebuild_queue, rebuild_time * 1000))
+                else:
+                    print("%d meshes waiting to be built or uploaded." % len(streamer.meshing))
+                    count, nbytes = streamer.resident()
+                    print("%d chunks loaded, taking %.1f MB." % (count, nbytes / 1048576.0))
+            if event.key == K_g:
+                if greedy_meshing:
+                    greedy_meshing = False
+                else:
+                    greedy_meshing = True
+                if streamer is not None:
+                    streamer.greedy = greedy_meshing
+                for chunk in world.chunks.values():
+                    chunk.dirty = True
+                print("Greedy meshing %s." % ["off", "on"][greedy_meshing])
             if event.key == K_e:
                 x, y, z, n = camera_matrix.forward
                 place(list(translate), [x, y, z])
+            if event.key == K_o:
+                if occlusion_culling:
+                    occlusion_culling = False
+                else:
+                    occlusion_culling = True
+                for chunk in world.chunks.values():
+                    chunk.occluded = False
+                print("Occlusion culling %s." % ["off", "on"][occlusion_culling])
+            if event.key == K_v:
+                if lod_distances:
+                    lod_distances = []
+                else:
+                    lod_distances = mesher.lod_distances
+                if streamer is not None:
+                    streamer.lod_distances = lod_distances
+                print("Level of detail %s." % ["off", "on"][len(lod_distances) > 0])
       
     # time since last space bar press
     space += time_passed_seconds
     
+    # saves the chunks changed since the last save every so often
+    autosave_count += time_passed_seconds
+    if autosave_count > autosave_delay:
+        autosave_count = 0
+        save_chunks(world, store)
+    
     # Clear the screen, and z-buffer
     #glClear(GL_DEPTH_BUFFER_BIT | GL_COLOR_BUFFER_BIT)
     glClear(GL_DEPTH_BUFFER_BIT)
@@ -1276,17 +811,21 @@ while True:
             y_vel = -10
         change[1] += time_passed_seconds * y_vel
         
+    # waits at the edge of the ground streamed in so far
+    if streamer is not None and world.chunk_at(translate[0] + change[0], translate[2] + change[2]) is None:
+        change = [0, 0, 0]
+        
     # collision detection and resolution
     grounded = False
-    for i in [0, 2, 1]:
+    if collision:
+        falling = change[1] < 0
+        box = [translate[0] - 0.3, translate[1] - 1.5, translate[2] - 0.3, translate[0] + 0.3, translate[1] + 0.3, translate[2] + 0.3]
+        change, stopped = world.sweep(box, change)
+        if stopped[1]:
+            grounded = falling
+            y_vel = 0
+    for i in [0, 1, 2]:
         translate[i] = translate[i] + change[i]
-        if collision:
-            if collide(translate[0] - 0.3, translate[1] - 1.5, translate[2] - 0.3, translate[0] + 0.3, translate[1] + 0.3, translate[2] + 0.3) or translate[0] - 0.3 < 0 or translate[0] + 0.3 > world_size or translate[2] - 0.3 < 0 or translate[2] + 0.3 > world_size:
-                translate[i] = translate[i] - change[i] 
-                if i == 1:
-                    grounded = True
-                    translate[1] = int(translate[1] - 1.5) + 1.501
-                    y_vel = 0
                 
     # reset camera matrix
     camera_matrix = Matrix44()
@@ -1322,53 +861,96 @@ while True:
     skybox.render(translate[0] - 0.5, translate[1] - 0.5, translate[2] - 0.5)
     glEnable(GL_DEPTH_TEST)
     glEnable(GL_LIGHTING)
-    for chunk in chunks:
-        if chunk.display_list is None:
-            
-            # Starts display list
-            chunk.display_list = glGenLists(1) 
-            glNewList(chunk.display_list, GL_COMPILE)
-            
-            # renders the chunk
-            chunk.render()
-            
-            # Ends display list
-            glEndList()
+    if streamer is not None:
+        
+        # streams chunks in and uploads as many meshes as there is time for
+        x, y, z, n = camera_matrix.forward
+        for chunk in streamer.update(translate, [-x, -y, -z], view_distance):
+            if chunk.mesh is not None:
+                glDeleteBuffers(1, [chunk.mesh])
+            if chunk.query is not None:
+                glDeleteQueries(1, [chunk.query])
+        for chunk, vertices, batches in streamer.finished(time.time() + upload_budget):
+            upload_chunk_mesh(chunk, vertices, batches)
+    if streamer is None:
+        
+        # remeshes as many chunks as there is time for
+        rebuild_chunks(rebuild_budget)
+                
+    # finds the chunks the camera might see into through caves and
+    # open air, again only once it moves to another section or
+    # chunks have been meshed since
+    if occlusion_culling:
+        section = (int(math.floor(translate[0])) >> 4, int(math.floor(translate[1])) // visibility.section_height, int(math.floor(translate[2])) >> 4, meshes_uploaded, view_distance)
+        if section != visibility_key:
+            visibility_key = section
+            reachable = visibility.visible_chunks(world, translate, view_distance)
             
-        else:
+    # draws the chunks within the view distance that are inside the view frustum
+    draw_calls = 0
+    chunks_drawn = 0
+    frame += 1
+    shown = [chunk for chunk in world.chunks.values() if chunk.bounds is not None and chunk.mesh is not None]
+    if shown:
+        view = frustum.planes(glGetDoublev(GL_PROJECTION_MATRIX), glGetDoublev(GL_MODELVIEW_MATRIX))
+        inside = frustum.inside(view, [chunk.bounds for chunk in shown])
+        candidates = []
+        for chunk, visible in zip(shown, inside):
             distance = math.sqrt((translate[0] - (chunk.x + 8))**2 + (translate[2] - (chunk.z + 8))**2)
-            if distance < view_distance:
-                display = False
-                x, y, z, n = camera_matrix.forward
-                if translate[0] > chunk.x and translate[0] < chunk.x + 16 and translate[1] > 0 and translate[1] < world_height and translate[2] > chunk.z and translate[2] < chunk.z + 16:
-                    display = True
-                if not display:
-                    for pointx in [chunk.x, chunk.x + 16 , chunk.x + 8]:
-                        for pointy in range(0, world_height + 4, 4):
-                            for pointz in [chunk.z, chunk.z + 16, chunk.z + 8]:
-                                chunk_vector = [pointx - translate[0], pointy - translate[1], pointz - translate[2]]
-                                distance = math.sqrt(chunk_vector[0]**2 + chunk_vector[1]**2 + chunk_vector[2]**2)
-                                chunk_vector[0] /= distance
-                                chunk_vector[1] /= distance
-                                chunk_vector[2] /= distance
-                                if dot_product(chunk_vector, [x, y, z]) < -0.67: # if any point is in view, display that chunk
-                                    display = True
-                if display:
-                    
-                    # calls the display list
-                    glCallList(chunk.display_list)
+            if not visible or distance >= view_distance:
+                continue
+            if occlusion_culling:
+                if reachable is not None and (chunk.x >> 4, chunk.z >> 4) not in reachable:
+                    continue
+                candidates.append(chunk)
+                
+                # an answer from before the chunk last left the
+                # candidates may be long out of date, so it is asked again
+                if chunk.queried != frame - 1:
+                    chunk.occluded = False
+                    chunk.querying = False
                 
+                # the box around the chunk the camera is in may be too
+                # close to show up, so that chunk is always drawn
+                low, high = chunk.bounds[0:3], chunk.bounds[3:6]
+                if all([low[i] - 1 <= translate[i] <= high[i] + 1 for i in [0, 1, 2]]):
+                    chunk.occluded = False
+                if chunk.occluded:
+                    continue
+                
+            # draws the vertex buffer
+            draw_calls += draw_chunk(chunk)
+            chunks_drawn += 1
+        if occlusion_culling:
+            query_occlusion(candidates, frame)
+            
+    # reports how long the player waited to see the world
+    if first_frame is None and chunks_drawn > 0:
+        first_frame = time.time() - startup
+        print("First frame drawn %.2f seconds after startup." % first_frame)
+    if not world_filled and streamer is not None and streamer.fill and streamer.filled():
+        world_filled = True
+        print("Whole world in %.2f seconds after startup." % (time.time() - startup))
+        save_chunks(world, store)
+        level_settings["complete"] = True
+        save_level(world_directory, level_settings)
+    
+    # outlines the block the player is looking at
+    x, y, z, n = camera_matrix.forward
+    target = world.raycast(translate, [-x, -y, -z], 4)
+    if target is not None:
+        draw_highlight(*target[0])
+            
     if display_chunks:
         glDisable(GL_TEXTURE_2D)
-        for x in range(0, world_size + 16, 16):
-            for z in range(0, world_size + 16, 16):
-                a = [x, -8, z]
-                b = [x, world_height + 8, z]
-                glColor(1.0, 0.0, 0.0)
-                glBegin(GL_LINES)
-                glVertex3f(*a)
-                glVertex3f(*b)
-                glEnd()
+        for chunk in world.chunks.values():
+            a = [chunk.x, -8, chunk.z]
+            b = [chunk.x, world_height + 8, chunk.z]
+            glColor(1.0, 0.0, 0.0)
+            glBegin(GL_LINES)
+            glVertex3f(*a)
+            glVertex3f(*b)
+            glEnd()
         glColor(1.0, 1.0, 1.0, 1.0)
         glEnable(GL_TEXTURE_2D)
        
@@ -0,0 +1,319 @@
+'''Turns the blocks of a chunk into vertex arrays that OpenGL can
+draw straight out of a vertex buffer.  Nothing in here talks to
+OpenGL itself, main.py uploads and draws what these functions build.'''
+
+import numpy
+
+from blocks import block_types, AIR
+from sections import section_height
+from world import block_normals
+
+# block information
+block_vertices = [
+    [0.0, 0.0, 1.0],
+    [1.0, 0.0, 1.0],
+    [1.0, 1.0, 1.0],
+    [0.0, 1.0, 1.0],
+    [0.0, 0.0, 0.0],
+    [1.0, 0.0, 0.0],
+    [1.0, 1.0, 0.0],
+    [0.0, 1.0, 0.0]
+]
+block_faces = [ (0, 1, 2, 3),
+    (4, 5, 6, 7),  # back
+    (1, 5, 6, 2),  # right
+    (0, 4, 7, 3),  # left
+    (3, 2, 6, 7),  # top
+    (0, 1, 5, 4) ] # bottom
+
+# the texture coordinates of the four corners of a face
+face_uvs = [(0, 0), (1, 0), (1, 1), (0, 1)]
+
+# floats per vertex: x, y, z, u, v, r, g, b
+vertex_size = 8
+
+# how bright a corner is with 0, 1, 2 or 3 of the blocks around it
+# left open, so corners tucked into other blocks come out darker
+occlusion = [0.5, 0.65, 0.8, 1.0]
+
+# chunks are meshed in full detail up to the first distance, from
+# blocks twice as big up to the next and so on, doubling each time
+lod_distances = [64, 128]
+
+# how many big blocks down the skirts along the edges of a chunk
+# meshed in less detail reach below its surface
+skirt_depth = 2
+
+def texture_table():
+    '''Returns an array holding the texture id of each face of
+    every registered block type, indexed [block id, face].'''
+    return numpy.array([block_type.texture_ids for block_type in block_types], numpy.int32)
+
+def faces(world, chunk, light=None):
+    '''Yields, for each of the six face directions, the face index,
+    the y of the bottom layer, a mask of the blocks showing that face,
+    the texture id of that face and the shade of its four corners for
+    every block in the part of the chunk World.span finds may have
+    faces showing.  The light of the chunk and the blocks around it
+    may be given, padded the way World.padded pads it, otherwise it
+    comes from the world.'''
+    textures = texture_table()
+    if light is None:
+        light = world.padded(chunk, "light", 0, world.maximum_light, 0, 0)
+    bottom, top = world.span(chunk)
+    height = top - bottom
+    blocks = chunk.blocks.dense(bottom, top)
+    blocked = chunk.blocked.dense(bottom, top)
+    solid = world.padded_solid(chunk)[:, bottom:top + 2, :]
+    lit = numpy.where(solid, 0, light[:, bottom:top + 2, :]).astype(numpy.float32)
+
+    def around(array, offset):
+        dx, dy, dz = offset
+        return array[1 + dx:17 + dx, 1 + dy:height + 1 + dy, 1 + dz:17 + dz]
+
+    for i in range(0, len(block_faces)):
+        visible = (blocks != AIR) & (blocked & (1 << i) == 0)
+        normal = block_normals[i]
+        shade = numpy.empty(blocks.shape + (4,), numpy.float32)
+        for k, corner in enumerate(block_faces[i]):
+
+            # a corner is lit by the four blocks touching it on the
+            # side the face looks out to: the one in front of the face,
+            # the two next to that one along the edges meeting at the
+            # corner and the one diagonally across from it
+            sides = []
+            for axis in [0, 1, 2]:
+                if normal[axis] == 0:
+                    side = list(normal)
+                    side[axis] = [-1, 1][int(block_vertices[corner][axis])]
+                    sides.append(side)
+            diagonal = [sides[0][a] + sides[1][a] - normal[a] for a in [0, 1, 2]]
+            touching = [normal, sides[0], sides[1], diagonal]
+
+            total = sum([around(lit, offset) for offset in touching])
+            count = sum([(~around(solid, offset)).astype(int) for offset in touching])
+            side_a, side_b, across = [around(solid, offset) for offset in touching[1:]]
+            open_blocks = numpy.where(side_a & side_b, 0, 3 - side_a.astype(int) - side_b - across)
+            shade[..., k] = total / numpy.maximum(count, 1) / world.maximum_light * numpy.array(occlusion, numpy.float32)[open_blocks]
+        yield i, bottom, visible, textures[blocks, i], shade
+
+def single_faces(world, chunk, light=None):
+    '''Returns one quad for every visible face as a list of
+    (face, starts, sizes, textures, light) arrays.'''
+    quads = []
+    for i, bottom, visible, textures, shade in faces(world, chunk, light):
+        cells = numpy.argwhere(visible)
+        if len(cells) == 0:
+            continue
+        cells[:, 1] += bottom
+        quads.append((i, cells, numpy.ones(cells.shape, numpy.int32), textures[visible], shade[visible]))
+    return quads
+
+def greedy_rectangles(keys):
+    '''Splits the non zero cells of a 2D array into rectangles of
+    equal keys, growing each one along rows first and then down
+    the columns.  Returns a list of (i, j, height, width, key).'''
+    rows, columns = keys.shape
+    cells = numpy.argwhere(keys).tolist()
+
+    # plain lists, as indexing numpy one cell at a time is slow
+    keys = keys.tolist()
+    rectangles = []
+    for i, j in cells:
+        row = keys[i]
+        key = row[j]
+        if key == 0:
+            continue
+        width = 1
+        while j + width < columns and row[j + width] == key:
+            width += 1
+        height = 1
+        while i + height < rows and keys[i + height][j:j + width] == [key] * width:
+            height += 1
+        for k in range(i, i + height):
+            keys[k][j:j + width] = [0] * width
+        rectangles.append((i, j, height, width, key))
+    return rectangles
+
+def greedy_faces(world, chunk, light=None):
+    '''Returns quads covering every visible face, merging
+    neighboring faces that lie in the same plane, share a texture and
+    have the same four corner shades into one bigger quad.  The bigger
+    quad takes those four shades at its own corners, so a face shaded
+    unevenly has its shading stretched over the whole quad rather than
+    repeated on every block.  Same format as single_faces.'''
+    quads = []
+    for i, bottom, visible, textures, shade in faces(world, chunk, light):
+        if not visible.any():
+            continue
+        axis = [abs(n) for n in block_normals[i]].index(1)
+        across = [a for a in [0, 1, 2] if a != axis]
+
+        # the texture and the four corner shades, a byte each
+        levels = numpy.round(shade * 255).astype(numpy.int64) << numpy.array([0, 8, 16, 24])
+        keys = numpy.where(visible, (textures.astype(numpy.int64) << 32) + levels.sum(axis=-1) + 1, 0)
+        starts = []
+        sizes = []
+        for layer in range(0, keys.shape[axis]):
+            plane = numpy.take(keys, layer, axis=axis)
+            for row, column, height, width, key in greedy_rectangles(plane):
+                start = [0, 0, 0]
+                size = [1, 1, 1]
+                start[axis] = layer
+                start[across[0]], start[across[1]] = row, column
+                size[across[0]], size[across[1]] = height, width
+                starts.append(start)
+                sizes.append(size)
+        starts = numpy.array(starts, numpy.int32)
+        cells = tuple(starts.T)
+        starts[:, 1] += bottom
+        quads.append((i, starts, numpy.array(sizes, numpy.int32), textures[cells], shade[cells]))
+    return quads
+
+def lod_scale(distance, distances=lod_distances):
+    '''Returns how big the blocks a chunk at distance is meshed from
+    should be.'''
+    scale = 1
+    for ring in distances:
+        if distance < ring:
+            return scale
+        scale *= 2
+    return scale
+
+def downsample(array, scale, fill):
+    '''Splits an array of a chunk into cubes scale blocks wide,
+    filling the top up with fill to make the height fit, and returns
+    it indexed [x, y, z, block in the cube].'''
+    width, height, depth = array.shape
+    tall = (height + scale - 1) // scale * scale
+    grown = numpy.empty((width, tall, depth), array.dtype)
+    grown[:, 0:height, :] = array
+    grown[:, height:, :] = fill
+    cubes = grown.reshape(width // scale, scale, tall // scale, scale, depth // scale, scale)
+    return cubes.transpose(0, 2, 4, 1, 3, 5).reshape(width // scale, tall // scale, depth // scale, scale ** 3)
+
+def lod_faces(world, chunk, scale, light=None):
+    '''Returns quads for a chunk meshed from blocks scale times as big
+    as normal, in the same format as single_faces.
+
+    A big block is solid when any block in it is and looks like the
+    highest block in it, so a chunk meshed in less detail never sits
+    below one meshed in more.  Any gap along the edge of the chunk is
+    then covered by a skirt: the outer faces of the top few big
+    blocks of every column along the edge are always drawn.'''
+    if light is None:
+        light = world.padded(chunk, "light", 0, world.maximum_light, 0, 0)
+
+    # starts from a whole section, so the big blocks line up
+    bottom, top = world.span(chunk)
+    bottom = bottom // section_height * section_height
+    cubes = downsample(chunk.blocks.dense(bottom, max(top, bottom)), scale, AIR)
+    solid = cubes != AIR
+
+    # picks the highest solid block of each big block
+    heights = numpy.arange(0, scale ** 3) // scale % scale
+    highest = numpy.argmax(numpy.where(solid, heights + 1, 0), axis=-1)
+    kinds = numpy.take_along_axis(cubes, highest[..., numpy.newaxis], axis=-1)[..., 0]
+    solid = solid.any(axis=-1)
+    kinds = numpy.where(solid, kinds, AIR)
+
+    # each big block is lit by the brightest block in it
+    lit = downsample(light[1:17, bottom + 1:max(top, bottom) + 1, 1:17], scale, world.maximum_light).max(axis=-1)
+    width, height, depth = solid.shape
+
+    padded = numpy.ones((width + 2, height + 2, depth + 2), bool)
+    padded[1:-1, 1:-1, 1:-1] = solid
+    padded[:, -1, :] = False
+    padded_light = numpy.zeros(padded.shape, numpy.uint8) + world.maximum_light
+    padded_light[1:-1, 1:-1, 1:-1] = lit
+
+    # the big blocks near the top of each column
+    y = numpy.arange(0, height)[numpy.newaxis, :, numpy.newaxis]
+    surface = height - numpy.argmax(solid[:, ::-1, :], axis=1)
+    skirt = y >= surface[:, numpy.newaxis, :] - skirt_depth
+
+    textures = texture_table()
+    quads = []
+    for i, (dx, dy, dz) in enumerate(block_normals):
+        visible = solid & ~padded[1 + dx:width + 1 + dx, 1 + dy:height + 1 + dy, 1 + dz:depth + 1 + dz]
+        if dx != 0 or dz != 0:
+            edge = [slice(None)] * 3
+            edge[0 if dx != 0 else 2] = -1 if dx + dz > 0 else 0
+            visible[tuple(edge)] |= (solid & skirt)[tuple(edge)]
+        cells = numpy.argwhere(visible)
+        if len(cells) == 0:
+            continue
+        front = padded_light[1 + dx:width + 1 + dx, 1 + dy:height + 1 + dy, 1 + dz:depth + 1 + dz][visible]
+        shade = numpy.repeat((front / float(world.maximum_light)).astype(numpy.float32)[:, numpy.newaxis], 4, axis=1)
+        starts = cells * scale
+        starts[:, 1] += bottom
+        quads.append((i, starts, numpy.zeros(cells.shape, numpy.int32) + scale, textures[kinds[visible], i], shade))
+    return quads
+
+def build_mesh(world, chunk, atlas=None, greedy=False, light=None, scale=1):
+    '''Builds the quads of every visible face in a chunk.
+
+    Returns an interleaved float32 array with one row per vertex
+    and a list of (texture id, first vertex, vertex count) batches.
+    Given a texture atlas the texture coordinates point into the
+    atlas and there is a single batch for the whole chunk, otherwise
+    the quads are sorted into one batch per texture.
+
+    Greedy meshing merges faces into bigger quads whose textures
+    have to repeat across them.  A tile of the atlas cannot repeat,
+    so greedy meshes always use the separate textures.  So do meshes
+    built from bigger blocks than normal, when scale is more than one.
+
+    light is passed on to faces.'''
+    origin = numpy.array([chunk.x, 0, chunk.z], numpy.float32)
+    corners = numpy.array(block_vertices, numpy.float32)
+
+    if scale > 1:
+        face_quads = lod_faces(world, chunk, scale, light)
+        atlas = None
+    elif greedy:
+        face_quads = greedy_faces(world, chunk, light)
+        atlas = None
+    else:
+        face_quads = single_faces(world, chunk, light)
+
+    quads = []
+    quad_textures = []
+    for i, starts, sizes, textures, shade in face_quads:
+        face = corners[list(block_faces[i])]
+
+        # the texture runs along the axes going from the first
+        # corner of the face to the second and to the fourth
+        u_axis = numpy.argmax(abs(face[1] - face[0]))
+        v_axis = numpy.argmax(abs(face[3] - face[0]))
+
+        vertices = numpy.empty((len(starts), 4, vertex_size), numpy.float32)
+        vertices[:, :, 0:3] = starts[:, numpy.newaxis, :] + face * sizes[:, numpy.newaxis, :] + origin
+        vertices[:, :, 3] = numpy.array(face_uvs)[:, 0] * sizes[:, u_axis, numpy.newaxis]
+        vertices[:, :, 4] = numpy.array(face_uvs)[:, 1] * sizes[:, v_axis, numpy.newaxis]
+        vertices[:, :, 5:8] = shade[:, :, numpy.newaxis]
+        quads.append(vertices)
+        quad_textures.append(textures)
+
+    if not quads:
+        return numpy.zeros((0, vertex_size), numpy.float32), []
+
+    quads = numpy.concatenate(quads)
+    quad_textures = numpy.concatenate(quad_textures)
+
+    if atlas is not None:
+        rects = atlas.uvs[quad_textures][:, numpy.newaxis, :]
+        quads[:, :, 3] = rects[..., 0] + quads[:, :, 3] * (rects[..., 2] - rects[..., 0])
+        quads[:, :, 4] = rects[..., 1] + quads[:, :, 4] * (rects[..., 3] - rects[..., 1])
+        return quads.reshape(-1, vertex_size), [(atlas.texture_id, 0, len(quads) * 4)]
+
+    # groups the quads by texture so each texture is a single draw call
+    order = numpy.argsort(quad_textures, kind="stable")
+    quads = quads[order]
+    texture_ids, counts = numpy.unique(quad_textures[order], return_counts=True)
+    batches = []
+    first = 0
+    for texture_id, count in zip(texture_ids, counts):
+        batches.append((int(texture_id), first, int(count) * 4))
+        first += int(count) * 4
+    return quads.reshape(-1, vertex_size), batches
@@ -0,0 +1,303 @@
+'''The value noise the terrain is shaped with.
+
+Every function comes in two forms: one taking a single point, and
+a batched one taking NumPy arrays of coordinates which gives exactly
+the same numbers for a whole grid of points at once.'''
+
+import math
+
+import numpy
+
+mask = (1 << 64) - 1
+
+def hash(seed, x, y, z):
+    '''Mixes a seed and a block position into a float between 0 and 1.
+    Works on 64 bit integers that wrap around, so any position, even
+    a negative one, gives a number, and the same one every time.'''
+    h = (seed * 0x9E3779B97F4A7C15 + x * 0xC2B2AE3D27D4EB4F + y * 0x165667B19E3779F9 + z * 0x27D4EB2F165667C5) & mask
+    h ^= h >> 30
+    h = (h * 0xBF58476D1CE4E5B9) & mask
+    h ^= h >> 27
+    h = (h * 0x94D049BB133111EB) & mask
+    h ^= h >> 31
+    return (h >> 11) * (1.0 / (1 << 53))
+
+def hash_array(seed, x, y, z):
+    '''hash for arrays of positions.'''
+    x, y, z = [numpy.asarray(c).astype(numpy.int64).astype(numpy.uint64) for c in (x, y, z)]
+    with numpy.errstate(over="ignore"):
+        h = numpy.uint64((seed * 0x9E3779B97F4A7C15) & mask)
+        h = h + x * numpy.uint64(0xC2B2AE3D27D4EB4F) + y * numpy.uint64(0x165667B19E3779F9) + z * numpy.uint64(0x27D4EB2F165667C5)
+        h = h ^ (h >> numpy.uint64(30))
+        h = h * numpy.uint64(0xBF58476D1CE4E5B9)
+        h = h ^ (h >> numpy.uint64(27))
+        h = h * numpy.uint64(0x94D049BB133111EB)
+        h = h ^ (h >> numpy.uint64(31))
+    return (h >> numpy.uint64(11)) * (1.0 / (1 << 53))
+
+def interpolate(a, b, x):
+    ft = x * 3.1415927
+    f = (1.0 - math.cos(ft)) * 0.5
+    return float(a * (1.0 - f) + b * f)
+
+def fade(x):
+    '''Works out the cosine blend factor of interpolate for a whole
+    array.  A grid only holds a handful of distinct fractions, so they
+    are run through math.cos one by one, which keeps the results the
+    same as the single point version down to the last bit.'''
+    fractions, inverse = numpy.unique(x, return_inverse=True)
+    f = numpy.array([(1.0 - math.cos(fraction * 3.1415927)) * 0.5 for fraction in fractions])
+    return f[inverse].reshape(numpy.shape(x))
+
+def interpolate_array(a, b, x):
+    f = fade(x)
+    return a * (1.0 - f) + b * f
+
+class Noise:
+    '''Noise made by hashing the position with the seed of the world,
+    so it needs no table and goes on forever in every direction.
+    2D noise is the x = 9 slice of the 3D noise.'''
+
+    def __init__(self, seed):
+        self.seed = seed
+
+    def noise(self, x, y):
+        return self.noise_3d(9, x, y)
+
+    def noise_array(self, x, y):
+        return self.noise_3d_array(9, x, y)
+
+    def smooth_noise(self, x, y):
+        return self.noise(x, y)
+
+    def smooth_noise_array(self, x, y):
+        return self.noise_array(x, y)
+
+    def interpolated_noise(self, x, y):
+
+        integer_x    = int(math.floor(x))
+        fractional_x = x - integer_x
+
+        integer_y    = int(math.floor(y))
+        fractional_y = y - integer_y
+
+        v1 = self.smooth_noise(integer_x, integer_y)
+        v2 = self.smooth_noise(integer_x + 1, integer_y)
+        v3 = self.smooth_noise(integer_x, integer_y + 1)
+        v4 = self.smooth_noise(integer_x + 1, integer_y + 1)
+
+        i1 = interpolate(v1, v2, fractional_x)
+        i2 = interpolate(v3, v4, fractional_x)
+
+        return interpolate(i1 , i2 , fractional_y)
+
+    def interpolated_noise_array(self, x, y):
+
+        integer_x    = numpy.floor(x).astype(numpy.int64)
+        fractional_x = x - integer_x
+
+        integer_y    = numpy.floor(y).astype(numpy.int64)
+        fractional_y = y - integer_y
+
+        v1 = self.smooth_noise_array(integer_x, integer_y)
+        v2 = self.smooth_noise_array(integer_x + 1, integer_y)
+        v3 = self.smooth_noise_array(integer_x, integer_y + 1)
+        v4 = self.smooth_noise_array(integer_x + 1, integer_y + 1)
+
+        i1 = interpolate_array(v1, v2, fractional_x)
+        i2 = interpolate_array(v3, v4, fractional_x)
+
+        return interpolate_array(i1, i2, fractional_y)
+
+    def perlin_noise(self, x, y, octaves=1, frequency=1 / 32.0, persistence=0.5):
+        '''Adds up octaves of noise, each at twice the frequency and
+        persistence times the amplitude of the one before.'''
+        average = 0
+        amplitude = 1.0
+        for i in range(0, octaves):
+            average += amplitude * self.interpolated_noise(x * frequency, y * frequency)
+            frequency *= 2
+            amplitude *= persistence
+        return average
+
+    def perlin_noise_array(self, x, y, octaves=1, frequency=1 / 32.0, persistence=0.5):
+        '''perlin_noise for arrays of points.'''
+        x = numpy.asarray(x, numpy.float64)
+        y = numpy.asarray(y, numpy.float64)
+        average = numpy.zeros(numpy.broadcast(x, y).shape)
+        amplitude = 1.0
+        for i in range(0, octaves):
+            average += amplitude * self.interpolated_noise_array(x * frequency, y * frequency)
+            frequency *= 2
+            amplitude *= persistence
+        return average
+
+    def perlin_grid(self, x, z, width, depth, octaves=1, frequency=1 / 32.0, persistence=0.5):
+        '''Returns the noise for a width x depth grid of columns
+        starting at x, z, indexed [x, z].'''
+        xs, zs = numpy.meshgrid(numpy.arange(x, x + width), numpy.arange(z, z + depth), indexing="ij")
+        return self.perlin_noise_array(xs, zs, octaves, frequency, persistence)
+
+    def noise_3d(self, x, y, z):
+        return hash(self.seed, x, y, z)
+
+    def noise_3d_array(self, x, y, z):
+        return hash_array(self.seed, x, y, z)
+
+    def smooth_noise_3d(self, x, y, z):
+        corners = 0
+        sides = 0
+        corners += self.noise_3d(x - 1, y - 1, z - 1)
+        corners += self.noise_3d(x - 1, y - 1, z + 1)
+        corners += self.noise_3d(x + 1, y - 1, z - 1)
+        corners += self.noise_3d(x + 1, y - 1, z + 1)
+        corners += self.noise_3d(x - 1, y + 1, z - 1)
+        corners += self.noise_3d(x - 1, y + 1, z + 1)
+        corners += self.noise_3d(x + 1, y + 1, z - 1)
+        corners += self.noise_3d(x + 1, y + 1, z + 1)
+        sides += self.noise_3d(x - 1, y, z)
+        sides += self.noise_3d(x + 1, y, z)
+        sides += self.noise_3d(x, y - 1, z)
+        sides += self.noise_3d(x, y + 1, z)
+        sides += self.noise_3d(x, y, z - 1)
+        sides += self.noise_3d(x, y, z + 1)
+        corners *= (10.0 / 8.0) / 16.0
+        sides *= (2.0 / 6.0) / 16.0
+        center = self.noise_3d(x, y, z) / 4
+        return corners + sides + center
+
+    def smooth_noise_3d_array(self, x, y, z):
+        corners = 0
+        sides = 0
+        corners += self.noise_3d_array(x - 1, y - 1, z - 1)
+        corners += self.noise_3d_array(x - 1, y - 1, z + 1)
+        corners += self.noise_3d_array(x + 1, y - 1, z - 1)
+        corners += self.noise_3d_array(x + 1, y - 1, z + 1)
+        corners += self.noise_3d_array(x - 1, y + 1, z - 1)
+        corners += self.noise_3d_array(x - 1, y + 1, z + 1)
+        corners += self.noise_3d_array(x + 1, y + 1, z - 1)
+        corners += self.noise_3d_array(x + 1, y + 1, z + 1)
+        sides += self.noise_3d_array(x - 1, y, z)
+        sides += self.noise_3d_array(x + 1, y, z)
+        sides += self.noise_3d_array(x, y - 1, z)
+        sides += self.noise_3d_array(x, y + 1, z)
+        sides += self.noise_3d_array(x, y, z - 1)
+        sides += self.noise_3d_array(x, y, z + 1)
+        corners *= (10.0 / 8.0) / 16.0
+        sides *= (2.0 / 6.0) / 16.0
+        center = self.noise_3d_array(x, y, z) / 4
+        return corners + sides + center
+
+    def interpolated_noise_3d(self, x, y, z):
+
+        integer_x    = int(math.floor(x))
+        fractional_x = x - integer_x
+
+        integer_y    = int(math.floor(y))
+        fractional_y = y - integer_y
+
+        integer_z    = int(math.floor(z))
+        fractional_z = z - integer_z
+
+        v1 = self.smooth_noise_3d(integer_x, integer_y, integer_z)
+        v2 = self.smooth_noise_3d(integer_x + 1, integer_y, integer_z)
+        v3 = self.smooth_noise_3d(integer_x, integer_y + 1, integer_z)
+        v4 = self.smooth_noise_3d(integer_x + 1, integer_y + 1, integer_z)
+        i1 = interpolate(v1, v2, fractional_x)
+        i2 = interpolate(v3, v4, fractional_x)
+        left = interpolate(i1, i2, fractional_y)
+
+        v1 = self.smooth_noise_3d(integer_x, integer_y, integer_z + 1)
+        v2 = self.smooth_noise_3d(integer_x + 1, integer_y, integer_z + 1)
+        v3 = self.smooth_noise_3d(integer_x, integer_y + 1, integer_z + 1)
+        v4 = self.smooth_noise_3d(integer_x + 1, integer_y + 1, integer_z + 1)
+        i1 = interpolate(v1, v2, fractional_x)
+        i2 = interpolate(v3, v4, fractional_x)
+        right = interpolate(i1, i2, fractional_y)
+
+        return interpolate(left, right, fractional_z)
+
+    def interpolated_noise_3d_array(self, x, y, z):
+
+        integer_x    = numpy.floor(x).astype(numpy.int64)
+        fractional_x = x - integer_x
+
+        integer_y    = numpy.floor(y).astype(numpy.int64)
+        fractional_y = y - integer_y
+
+        integer_z    = numpy.floor(z).astype(numpy.int64)
+        fractional_z = z - integer_z
+
+        # neighboring points mostly share the corners of their lattice
+        # cell, so each corner is only smoothed once
+        corners = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0),
+                   (0, 0, 1), (1, 0, 1), (0, 1, 1), (1, 1, 1)]
+        points = numpy.array([[numpy.ravel(integer_x + dx), numpy.ravel(integer_y + dy), numpy.ravel(integer_z + dz)] for dx, dy, dz in corners])
+        points = points.transpose(1, 0, 2).reshape(3, -1)
+        lattice, inverse = numpy.unique(points, axis=1, return_inverse=True)
+        smooth = self.smooth_noise_3d_array(*lattice)[numpy.ravel(inverse)]
+        v = smooth.reshape((len(corners),) + numpy.shape(integer_x))
+
+        i1 = interpolate_array(v[0], v[1], fractional_x)
+        i2 = interpolate_array(v[2], v[3], fractional_x)
+        left = interpolate_array(i1, i2, fractional_y)
+
+        i1 = interpolate_array(v[4], v[5], fractional_x)
+        i2 = interpolate_array(v[6], v[7], fractional_x)
+        right = interpolate_array(i1, i2, fractional_y)
+
+        return interpolate_array(left, right, fractional_z)
+
+    def perlin_noise_3d(self, x, y, z):
+        average = 0
+        octaves = [32, 16, 8, 4]
+        for i in octaves:
+            average += self.interpolated_noise_3d(x / float(i), y / float(i), z / float(i)) / float(len(octaves))
+        return average
+
+    def perlin_noise_3d_array(self, x, y, z):
+        '''perlin_noise_3d for arrays of points.'''
+        x, y, z = numpy.broadcast_arrays(*[numpy.asarray(c, numpy.float64) for c in (x, y, z)])
+        average = numpy.zeros(x.shape)
+        octaves = [32, 16, 8, 4]
+        for i in octaves:
+            average += self.interpolated_noise_3d_array(x / float(i), y / float(i), z / float(i)) / float(len(octaves))
+        return average
+
+    def interpolated_noise_3d_grid(self, x, y, z):
+        '''interpolated_noise_3d for every point of the grid spanned
+        by three 1D arrays of coordinates.  The lattice corners of a
+        grid are themselves a small grid, so they are smoothed once
+        and shared by every point around them.'''
+        integers = [numpy.floor(c).astype(numpy.int64) for c in (x, y, z)]
+        fractions = [c - i for c, i in zip((x, y, z), integers)]
+        starts = [i.min() for i in integers]
+        lattice = self.smooth_noise_3d_array(*numpy.meshgrid(*[numpy.arange(i.min(), i.max() + 2) for i in integers], indexing="ij"))
+
+        # the index into the lattice of each point along each axis
+        ox = (integers[0] - starts[0])[:, numpy.newaxis, numpy.newaxis]
+        oy = (integers[1] - starts[1])[numpy.newaxis, :, numpy.newaxis]
+        oz = (integers[2] - starts[2])[numpy.newaxis, numpy.newaxis, :]
+        fractional_x = fractions[0][:, numpy.newaxis, numpy.newaxis]
+        fractional_y = fractions[1][numpy.newaxis, :, numpy.newaxis]
+        fractional_z = fractions[2][numpy.newaxis, numpy.newaxis, :]
+
+        i1 = interpolate_array(lattice[ox, oy, oz], lattice[ox + 1, oy, oz], fractional_x)
+        i2 = interpolate_array(lattice[ox, oy + 1, oz], lattice[ox + 1, oy + 1, oz], fractional_x)
+        left = interpolate_array(i1, i2, fractional_y)
+
+        i1 = interpolate_array(lattice[ox, oy, oz + 1], lattice[ox + 1, oy, oz + 1], fractional_x)
+        i2 = interpolate_array(lattice[ox, oy + 1, oz + 1], lattice[ox + 1, oy + 1, oz + 1], fractional_x)
+        right = interpolate_array(i1, i2, fractional_y)
+
+        return interpolate_array(left, right, fractional_z)
+
+    def perlin_grid_3d(self, x, y, z, width, height, depth):
+        '''Returns perlin_noise_3d for a width x height x depth box of
+        blocks starting at x, y, z, indexed [x, y, z].'''
+        xs, ys, zs = [numpy.arange(start, start + length, dtype=numpy.float64) for start, length in ((x, width), (y, height), (z, depth))]
+        average = numpy.zeros((width, height, depth))
+        octaves = [32, 16, 8, 4]
+        for i in octaves:
+            average += self.interpolated_noise_3d_grid(xs / float(i), ys / float(i), zs / float(i)) / float(len(octaves))
+        return average
@@ -0,0 +1,318 @@
+'''Keeps one kind of block data of a chunk cut into sections 16
+blocks high.  Most of a chunk is all air over the ground or all
+stone under it, so a section holding nothing but one value keeps
+just that value, and only the sections with something going on in
+them keep an array.
+
+Most of the sections left hold only a handful of block types, so
+they can also be kept packed: a palette of the values in the section
+and, for each block, its place in the palette in as few bits as it
+takes.'''
+
+import numpy
+
+section_height = 16
+
+class Packed:
+    '''A section kept as a palette and the place of each block's value
+    in it, packed 1, 2, 4 or 8 bits to the block so a block never
+    spans two bytes.  The palette grows, and the blocks get more bits,
+    as new values are set; a value no block holds any more leaves its
+    place free for the next new one.'''
+
+    def __init__(self, palette, counts, bits, data, shape):
+        self.palette = palette
+        self.counts = counts
+        self.bits = bits
+        self.data = data
+        self.shape = shape
+        self.places = dict([(value, place) for place, value in enumerate(palette) if counts[place] > 0])
+
+    @staticmethod
+    def from_array(array):
+        values, places, counts = numpy.unique(array, return_inverse=True, return_counts=True)
+        bits = packed_bits(len(values))
+        return Packed([int(value) for value in values], [int(count) for count in counts], bits,
+                      pack(places.reshape(-1), bits), array.shape)
+
+    @staticmethod
+    def full(shape, value):
+        size = shape[0] * shape[1] * shape[2]
+        return Packed([int(value)], [size], 1, numpy.zeros(size // 8, numpy.uint8), shape)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + len(self.palette)
+
+    def array(self):
+        palette = numpy.array(self.palette, numpy.uint8)
+        return palette[unpack(self.data, self.bits)].reshape(self.shape)
+
+    def index(self, x, y, z):
+        return (x * self.shape[1] + y) * self.shape[2] + z
+
+    def get(self, x, y, z):
+        i = self.index(x, y, z)
+        per = 8 // self.bits
+        return self.palette[(int(self.data[i // per]) >> (i % per * self.bits)) & ((1 << self.bits) - 1)]
+
+    def set(self, x, y, z, value):
+        value = int(value)
+        place = self.places.get(value)
+        if place is None:
+            if 0 in self.counts:
+                place = self.counts.index(0)
+                self.places.pop(self.palette[place], None)
+                self.palette[place] = value
+            else:
+                place = len(self.palette)
+                self.palette.append(value)
+                self.counts.append(0)
+                if place >= 1 << self.bits:
+                    self.repack(packed_bits(place + 1))
+            self.places[value] = place
+        i = self.index(x, y, z)
+        per = 8 // self.bits
+        shift = i % per * self.bits
+        mask = (1 << self.bits) - 1
+        byte = int(self.data[i // per])
+        self.counts[(byte >> shift) & mask] -= 1
+        self.counts[place] += 1
+        self.data[i // per] = (byte & ~(mask << shift) & 0xff) | (place << shift)
+
+    def repack(self, bits):
+        self.data = pack(unpack(self.data, self.bits), bits)
+        self.bits = bits
+
+    def copy(self):
+        return Packed(list(self.palette), list(self.counts), self.bits, self.data.copy(), self.shape)
+
+    def tobytes(self):
+        '''Returns the bits per block, the size of the palette less one,
+        the palette and the packed blocks, ready to save as they are.'''
+        return numpy.array([self.bits, len(self.palette) - 1] + self.palette, numpy.uint8).tobytes() + self.data.tobytes()
+
+    @staticmethod
+    def frombytes(data, offset, shape):
+        '''Reads a section written by tobytes.  Returns it and the
+        offset just past it.'''
+        bits, size = [int(value) for value in numpy.frombuffer(data, numpy.uint8, 2, offset)]
+        size += 1
+        palette = [int(value) for value in numpy.frombuffer(data, numpy.uint8, size, offset + 2)]
+        offset += 2 + size
+        length = shape[0] * shape[1] * shape[2] * bits // 8
+        packed = numpy.frombuffer(data, numpy.uint8, length, offset).copy()
+        counts = numpy.bincount(unpack(packed, bits), minlength=size)[0:size]
+        return Packed(palette, [int(count) for count in counts], bits, packed, shape), offset + length
+
+def packed_bits(count):
+    '''The fewest of 1, 2, 4 or 8 bits that tell count values apart.'''
+    bits = 1
+    while count > 1 << bits:
+        bits *= 2
+    return bits
+
+def pack(places, bits):
+    '''Packs a flat array of small numbers into bytes, bits each.'''
+    per = 8 // bits
+    shifts = numpy.arange(0, per, dtype=numpy.uint8) * bits
+    return (places.astype(numpy.uint8).reshape(-1, per) << shifts).sum(axis=1, dtype=numpy.uint8)
+
+def unpack(data, bits):
+    '''Unpacks the numbers pack packed.'''
+    per = 8 // bits
+    shifts = numpy.arange(0, per, dtype=numpy.uint8) * bits
+    return ((data[:, numpy.newaxis] >> shifts) & ((1 << bits) - 1)).reshape(-1)
+
+class Sections:
+    '''A 16 x height x 16 column of values, indexed [x, y, z] like the
+    arrays it stands in for.  Reading a single block or slices of it
+    gives numpy values and arrays, and so does writing, but whole
+    arrays only ever come out of it as copies: chunk.blocks != AIR
+    does not work, chunk.blocks.dense() != AIR does.
+
+    sections holds each section, either one value, a 16 x 16 x 16
+    array or a Packed, shorter for the last section when the height
+    is not a multiple of 16.  Sections that stop being all one value
+    are kept packed when packed is set and as arrays otherwise.'''
+
+    def __init__(self, height, value=0, dtype=numpy.uint8, packed=False):
+        self.height = height
+        self.dtype = numpy.dtype(dtype)
+        self.packed = packed
+        count = (height + section_height - 1) // section_height
+        self.sections = [value] * count
+
+    @property
+    def shape(self):
+        return (16, self.height, 16)
+
+    @property
+    def count(self):
+        '''How many sections the column is cut into.'''
+        return len(self.sections)
+
+    @property
+    def nbytes(self):
+        '''The memory taken by the arrays of the sections, and a byte
+        for each section kept as one value.'''
+        return sum([1 if self.uniform(index) is not None else section.nbytes
+                    for index, section in enumerate(self.sections)])
+
+    def span(self, index):
+        '''Returns the bottom and top y of a section.'''
+        return index * section_height, min((index + 1) * section_height, self.height)
+
+    def uniform(self, index):
+        '''Returns the value every block of a section holds, or None
+        if they do not all hold the same one.'''
+        section = self.sections[index]
+        if isinstance(section, (numpy.ndarray, Packed)):
+            return None
+        return section
+
+    def section(self, index):
+        '''Returns a section as an array.'''
+        section = self.sections[index]
+        if isinstance(section, numpy.ndarray):
+            return section
+        if isinstance(section, Packed):
+            return section.array()
+        bottom, top = self.span(index)
+        return numpy.full((16, top - bottom, 16), section, self.dtype)
+
+    def store(self, index, array):
+        '''Keeps an array as a section, the way this column keeps them.'''
+        first = array[0, 0, 0]
+        if (array == first).all():
+            self.sections[index] = int(first)
+        elif self.packed:
+            self.sections[index] = Packed.from_array(array)
+        else:
+            self.sections[index] = array
+
+    def region(self, x, bottom, top, z):
+        '''Returns the blocks from bottom up to top, and x and z
+        indexing those the same way they index an array.'''
+        parts = []
+        for index in range(bottom // section_height, (top + section_height - 1) // section_height):
+            low, high = self.span(index)
+            low, high = max(low, bottom) - low, min(high, top) - low
+            value = self.uniform(index)
+            if value is None:
+                parts.append(self.section(index)[x, low:high, z])
+            else:
+                shape = numpy.empty((16, high - low, 16), bool)[x, :, z].shape
+                parts.append(numpy.full(shape, value, self.dtype))
+        if not parts:
+            return numpy.empty(numpy.empty((16, 0, 16), bool)[x, :, z].shape, self.dtype)
+        if len(parts) == 1:
+            return parts[0].copy()
+
+        # y is the first axis left when x picks out a single block
+        return numpy.concatenate(parts, axis=1 if isinstance(x, slice) else 0)
+
+    def dense(self, bottom=0, top=None):
+        '''Returns the blocks from bottom up to top, or the whole
+        column, as one array.'''
+        if top is None:
+            top = self.height
+        return self.region(slice(None), bottom, top, slice(None))
+
+    def fill(self, value, bottom=0, top=None):
+        '''Sets the blocks from bottom up to top to a value, or to
+        an array of them when value is an array, in which case top
+        is bottom plus its height.'''
+        if isinstance(value, numpy.ndarray):
+            top = bottom + value.shape[1]
+        elif top is None:
+            top = self.height
+        for index in range(bottom // section_height, (top + section_height - 1) // section_height):
+            low, high = self.span(index)
+            start, stop = max(low, bottom), min(high, top)
+            if start == low and stop == high and not isinstance(value, numpy.ndarray):
+                self.sections[index] = value
+                continue
+            section = self.section(index).copy() if start != low or stop != high else None
+            if isinstance(value, numpy.ndarray):
+                part = value[:, start - bottom:stop - bottom, :]
+                if section is None:
+                    section = numpy.array(part, self.dtype)
+                else:
+                    section[:, start - low:stop - low, :] = part
+            else:
+                section[:, start - low:stop - low, :] = value
+            self.store(index, section)
+
+    def copy(self):
+        copy = Sections(self.height, 0, self.dtype, self.packed)
+        copy.sections = [section if self.uniform(index) is not None else section.copy()
+                         for index, section in enumerate(self.sections)]
+        return copy
+
+    def __getitem__(self, key):
+        x, y, z = key
+        if not isinstance(y, slice):
+            section = self.sections[y // section_height]
+            if isinstance(section, numpy.ndarray):
+                return section[x, y % section_height, z]
+            if not isinstance(x, slice) and not isinstance(z, slice):
+                if isinstance(section, Packed):
+                    return self.dtype.type(section.get(x, y % section_height, z))
+                return self.dtype.type(section)
+        return self.get_slice(x, y, z)
+
+    def get_slice(self, x, y, z):
+        '''Reads blocks picked out by slices as well as single places.'''
+        axis = 1 if isinstance(x, slice) else 0
+        if not isinstance(y, slice):
+            return numpy.take(self.region(x, y, y + 1, z), 0, axis=axis)
+        bottom, top, step = y.indices(self.height)
+        region = self.region(x, bottom, top, z)
+        if step != 1:
+            region = region[(slice(None),) * axis + (slice(None, None, step),)]
+        return region
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, tuple):
+            key = (key, slice(None), slice(None))
+        x, y, z = key
+        if not isinstance(x, slice) and not isinstance(y, slice) and not isinstance(z, slice):
+            index = y // section_height
+            section = self.sections[index]
+            if self.uniform(index) is not None:
+                if section == value:
+                    return
+                if self.packed:
+                    bottom, top = self.span(index)
+                    section = Packed.full((16, top - bottom, 16), section)
+                else:
+                    section = self.section(index).copy()
+                self.sections[index] = section
+            if isinstance(section, Packed):
+                section.set(x, y % section_height, z, value)
+                if section.counts[section.places[int(value)]] * section.bits == section.data.size * 8:
+                    self.sections[index] = int(value)
+                return
+            section[x, y % section_height, z] = value
+
+            # a section can only be all one value if it is all the
+            # value of its first block
+            if section[0, 0, 0] == value:
+                self.store(index, section)
+            return
+        self.set_slice(x, y, z, value)
+
+    def set_slice(self, x, y, z, value):
+        '''Writes blocks picked out by slices as well as single places.'''
+        if not isinstance(y, slice):
+            y = slice(y, y + 1)
+        bottom, top, step = y.indices(self.height)
+        if x == slice(None) and z == slice(None) and step == 1:
+            if isinstance(value, numpy.ndarray):
+                value = numpy.broadcast_to(value, (16, top - bottom, 16))
+            self.fill(value, bottom, top)
+            return
+        region = self.dense(bottom, top)
+        region[x, slice(0, None, step), z] = value
+        self.fill(region, bottom)
@@ -0,0 +1,365 @@
+'''Keeps chunks while they are out of the world, between runs of
+the game or just while the player is far away from them.
+
+A store only needs save, load and close; anything with those can
+stand in for the ones here.  Chunks are saved with the Sections of
+their block ids and light (see sections.py), the hidden face flags
+are cheap to work out again.'''
+
+import json, mmap, os, struct, zlib
+
+import numpy
+
+from blocks import AIR
+from light import light_chunk, sky_heights
+from columns import Columns
+from sections import Packed, Sections
+from world import Chunk
+
+# chunks along each side of a region file
+region_size = 32
+
+# the start of every region file: a tag and the height of its chunks,
+# the tag changed when chunks started being saved a section at a time
+region_header = struct.Struct("<4sI")
+region_tag = b"PYCS"
+
+# one entry per chunk after the header: where its data starts in
+# the file and how many bytes it takes, zero bytes if never saved
+region_entry = struct.Struct("<II")
+
+class MemoryStore:
+    '''Keeps saved chunks in a dictionary, so they last as long as
+    the game is running.'''
+
+    def __init__(self):
+        self.chunks = {}
+
+    def save(self, x, z, blocks, light):
+        '''Keeps the block ids and light of the chunk at x, z.'''
+        self.chunks[(x >> 4, z >> 4)] = (blocks.copy(), light.copy())
+
+    def load(self, x, z):
+        '''Returns the saved (block ids, light) of the chunk at x, z,
+        or None if it has never been saved.'''
+        saved = self.chunks.get((x >> 4, z >> 4))
+        if saved is None:
+            return None
+        return saved[0].copy(), saved[1].copy()
+
+    def close(self):
+        pass
+
+class RegionStore:
+    '''Keeps chunks in region files of 32 x 32 chunks each, inside
+    one directory per world.  The block ids it loads are kept the way
+    the world keeps them: palette packed with packed set (see
+    sections.py) and as runs with columns set (see columns.py).
+
+    A region file starts with a header and a table of where each of
+    its chunks is, then the chunks themselves as compressed block ids
+    and light.  Region files are read through memory maps, so loading
+    a chunk only ever reads that chunk from the disk.  Saving a chunk
+    writes it into the first gap between the chunks in the file it
+    fits in, or after the last chunk, then points its entry in the
+    table at it, leaving the rest of the file alone.  Its old copy is
+    only a gap once the table no longer points at it, so a crash part
+    way through a save always leaves one whole copy behind.  Closing the store packs the region files saved to
+    that have been left with too many gaps.'''
+
+    def __init__(self, directory, height, packed=False, columns=False):
+        self.directory = directory
+        self.height = height
+        self.packed = packed
+        self.columns = columns
+        self.maps = {}
+        self.saved = set()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def locate(self, x, z):
+        '''Returns the region holding the chunk at x, z, and where its
+        entry sits in the file.'''
+        key_x, key_z = x >> 4, z >> 4
+        index = (key_x % region_size) + (key_z % region_size) * region_size
+        return (key_x // region_size, key_z // region_size), region_header.size + index * region_entry.size
+
+    def path(self, region):
+        return os.path.join(self.directory, "r.%d.%d.dat" % region)
+
+    def map(self, region):
+        '''Returns a read only memory map of a region file, or None
+        if there is no such file yet.'''
+        if region not in self.maps:
+            if not os.path.exists(self.path(region)):
+                return None
+            region_file = open(self.path(region), "rb")
+            self.maps[region] = mmap.mmap(region_file.fileno(), 0, access=mmap.ACCESS_READ)
+            region_file.close()
+            tag, height = region_header.unpack_from(self.maps[region], 0)
+            if tag != region_tag or height != self.height:
+                raise ValueError("%s is not a region file of %d block high chunks" % (self.path(region), self.height))
+        return self.maps[region]
+
+    def load(self, x, z):
+        '''Returns the saved (block ids, light) of the chunk at x, z,
+        or None if it has never been saved.'''
+        region, entry = self.locate(x, z)
+        data = self.map(region)
+        if data is None:
+            return None
+        offset, length = region_entry.unpack_from(data, entry)
+        if length == 0:
+            return None
+        data = zlib.decompress(data[offset:offset + length])
+        blocks, used = unpack_blocks(data, 0, self.height, self.packed, self.columns)
+        light, used = unpack_sections(data, used, self.height)
+        return blocks, light
+
+    def save(self, x, z, blocks, light):
+        '''Writes the block ids and light of the chunk at x, z.'''
+        region, entry = self.locate(x, z)
+
+        # the file grows, so the old map of it is let go
+        if region in self.maps:
+            self.maps.pop(region).close()
+        if not os.path.exists(self.path(region)):
+            region_file = open(self.path(region), "wb")
+            region_file.write(region_header.pack(region_tag, self.height))
+            region_file.write(b"\0" * (region_entry.size * region_size * region_size))
+            region_file.close()
+
+        data = zlib.compress(pack_blocks(blocks) + pack_sections(light), 1)
+        region_file = open(self.path(region), "r+b")
+        region_file.seek(region_header.size)
+        table = region_file.read(region_entry.size * region_size * region_size)
+        offset = free_space(table, len(data))
+        region_file.seek(offset)
+        region_file.write(data)
+        region_file.seek(entry)
+        region_file.write(region_entry.pack(offset, len(data)))
+        region_file.close()
+        self.saved.add(region)
+
+    def compact(self, region, waste=0.25):
+        '''Rewrites a region file with its chunks one after another,
+        if more than waste of it is taken up by old copies of chunks.
+        The new file is written next to the old one and then takes
+        its place, so stopping part way never loses a chunk.'''
+        if region in self.maps:
+            self.maps.pop(region).close()
+        path = self.path(region)
+        region_file = open(path, "rb")
+        data = region_file.read()
+        region_file.close()
+        start = region_header.size + region_entry.size * region_size * region_size
+        entries = [region_entry.unpack_from(data, region_header.size + index * region_entry.size)
+                   for index in range(0, region_size * region_size)]
+        used = sum([length for offset, length in entries])
+        if len(data) - start - used <= len(data) * waste:
+            return
+        table = []
+        chunks = []
+        offset = start
+        for chunk_offset, length in entries:
+            table.append(region_entry.pack(offset if length else 0, length))
+            chunks.append(data[chunk_offset:chunk_offset + length])
+            offset += length
+        region_file = open(path + ".new", "wb")
+        region_file.write(data[0:region_header.size] + b"".join(table) + b"".join(chunks))
+        region_file.close()
+
+        # renaming onto a file that is there fails on Windows
+        if os.name == "nt":
+            os.remove(path)
+        os.rename(path + ".new", path)
+
+    def close(self):
+        for data in self.maps.values():
+            data.close()
+        self.maps = {}
+        for region in self.saved:
+            self.compact(region)
+        self.saved = set()
+
+def free_space(table, size):
+    '''Returns where in a region file with the given table of chunks
+    there is room for size bytes, in the first gap big enough between
+    the chunks, otherwise just past the last chunk.'''
+    start = region_header.size + len(table)
+    used = []
+    for index in range(0, len(table), region_entry.size):
+        offset, length = region_entry.unpack_from(table, index)
+        if length > 0:
+            used.append((offset, length))
+    used.sort()
+    for offset, length in used:
+        if offset - start >= size:
+            return start
+        start = max(start, offset + length)
+    return start
+
+# how a section is saved, past the values a uniform section can hold
+whole_section = 256
+packed_section = 257
+
+def pack_sections(sections):
+    '''Returns the bytes of the Sections of a chunk: for each section
+    the value all its blocks hold, or whole_section or packed_section
+    if they do not all hold the same one, followed by the blocks of
+    those sections.  A packed section is saved just as it is kept.'''
+    values = []
+    arrays = []
+    for index in range(0, len(sections.sections)):
+        section = sections.sections[index]
+        if sections.uniform(index) is not None:
+            values.append(section)
+        elif isinstance(section, Packed):
+            values.append(packed_section)
+            arrays.append(section.tobytes())
+        else:
+            values.append(whole_section)
+            arrays.append(numpy.ascontiguousarray(section).tobytes())
+    return numpy.array(values, "<u2").tobytes() + b"".join(arrays)
+
+def unpack_sections(data, offset, height, packed=False):
+    '''Reads Sections packed by pack_sections from data at offset.
+    Returns them and the offset just past them.  Sections saved
+    whole are packed when packed is set, packed ones stay packed.'''
+    sections = Sections(height, packed=packed)
+    count = len(sections.sections)
+    values = numpy.frombuffer(data, "<u2", count, offset)
+    offset += count * 2
+    for index in range(0, count):
+        bottom, top = sections.span(index)
+        if values[index] == packed_section:
+            sections.sections[index], offset = Packed.frombytes(data, offset, (16, top - bottom, 16))
+        elif values[index] == whole_section:
+            size = 16 * (top - bottom) * 16
+            sections.store(index, numpy.frombuffer(data, numpy.uint8, size, offset).reshape(16, top - bottom, 16).copy())
+            offset += size
+        else:
+            sections.sections[index] = int(values[index])
+    return sections, offset
+
+# the first two bytes of block ids saved as Columns, which no
+# section value can be
+column_chunk = 0xffff
+
+def pack_blocks(blocks):
+    '''Returns the bytes of the block ids of a chunk, kept as Sections
+    or as Columns, which are saved straight from their runs.'''
+    if isinstance(blocks, Columns):
+        return numpy.array([column_chunk], "<u2").tobytes() + blocks.tobytes()
+    return pack_sections(blocks)
+
+def unpack_blocks(data, offset, height, packed=False, columns=False):
+    '''Reads block ids packed by pack_blocks from data at offset, kept
+    as Columns when columns is set and as Sections otherwise.  Returns
+    them and the offset just past them.'''
+    if numpy.frombuffer(data, "<u2", 1, offset)[0] == column_chunk:
+        blocks, offset = Columns.frombytes(data, offset + 2, height)
+        if not columns:
+            sections = Sections(height, packed=packed)
+            sections.fill(blocks.dense())
+            blocks = sections
+    else:
+        blocks, offset = unpack_sections(data, offset, height, packed)
+        if columns:
+            runs = Columns(height)
+            runs.fill(blocks.dense())
+            blocks = runs
+    return blocks, offset
+
+def save_level(directory, settings):
+    '''Writes the settings a world was made with.'''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    level_file = open(os.path.join(directory, "level.json"), "w")
+    json.dump(settings, level_file, indent=4, sort_keys=True)
+    level_file.close()
+
+def load_level(directory):
+    '''Returns the settings a world was made with, or None if there
+    is no world saved in the directory.'''
+    path = os.path.join(directory, "level.json")
+    if not os.path.exists(path):
+        return None
+    level_file = open(path)
+    settings = json.load(level_file)
+    level_file.close()
+    return settings
+
+def save_chunks(world, store, chunks=None):
+    '''Saves the given chunks, or the chunks changed since they were
+    last saved.  Returns how many chunks were saved.'''
+    if chunks is None:
+        chunks = [chunk for chunk in world.chunks.values() if chunk.unsaved]
+    for chunk in chunks:
+        store.save(chunk.x, chunk.z, chunk.blocks, chunk.light)
+        chunk.unsaved = False
+    return len(chunks)
+
+def load_world(world, store, terrain=None):
+    '''Fills the world with the chunks saved in the store.
+
+    A world the game stopped saving part way through is missing
+    chunks.  Those are generated by terrain and filled in (see
+    fill_missing).  Returns how many chunks were missing.'''
+    missing = {}
+    for x in range(0, world.size, 16):
+        for z in range(0, world.size, 16):
+            chunk = Chunk(x, z, world)
+            saved = store.load(x, z)
+            if saved is not None:
+                chunk.blocks, chunk.light = saved
+                chunk.heights = sky_heights(chunk.blocks.dense() != AIR)
+            elif terrain is None:
+                raise ValueError("the chunk at %d, %d was never saved" % (x, z))
+            else:
+                chunk_blocks, missing[(x >> 4, z >> 4)] = terrain.generate_chunk(x, z)
+                chunk.blocks.fill(chunk_blocks)
+            world.add(chunk)
+    if missing:
+        fill_missing(world, terrain, missing)
+    return len(missing)
+
+def chunks_around(world, key):
+    '''The keys of a chunk and the eight chunks around it that are
+    inside the world.'''
+    return [(key[0] + dx, key[1] + dz) for dx in [-1, 0, 1] for dz in [-1, 0, 1]
+            if (key[0] + dx, key[1] + dz) in world.chunks]
+
+def fill_missing(world, terrain, missing):
+    '''Plants the trees that grow into newly generated chunks among
+    saved ones, given the trees of each keyed by chunk, then lights
+    them and the chunks around them again and marks them unsaved.
+    Trees never grow into a saved chunk, it already holds them.'''
+    trees = dict(missing)
+    growing = set()
+    for key in missing:
+        growing.update(chunks_around(world, key))
+    kept = {}
+    for key in growing:
+        for other in chunks_around(world, key):
+            if other not in trees:
+                chunk = world.chunks[other]
+                trees[other] = terrain.trees(chunk.x, chunk.z, terrain.heights(chunk.x, chunk.z))
+            if other not in missing and other not in kept:
+                kept[other] = world.chunks[other].blocks.copy()
+
+    # trees only crowd out the trees in the chunks next to their own
+    for key in sorted(growing):
+        nearby = []
+        for other in chunks_around(world, key):
+            nearby.extend(trees[other])
+        terrain.plant_trees(world, trees[key], nearby)
+    for key, blocks in kept.items():
+        world.chunks[key].blocks = blocks
+
+    # light spreads less than a chunk, so only the chunks next to the
+    # new ones see any change
+    for key in growing:
+        chunk = world.chunks[key]
+        light_chunk(world, chunk)
+        chunk.unsaved = True
@@ -0,0 +1,401 @@
+'''Streams the chunks around the player into the world in the
+background, so walking into new ground never has to wait for it.
+
+Chunks are generated on a pool of worker processes (see terrain.py)
+and meshed on a thread of their own.  Finished meshes wait in a
+bounded queue until the main loop uploads them, only as many each
+frame as fit in its time budget.  Chunks that fall far behind the
+player are unloaded again, the ones the player changed going into a
+store first (see store.py).  Nothing in here talks to OpenGL.'''
+
+import collections, copy, math, multiprocessing, threading, time, traceback
+from multiprocessing.pool import ThreadPool
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import mesher, visibility
+from light import light_chunk, sky_heights
+from store import MemoryStore, save_chunks
+from terrain import start_worker, generate_column
+from blocks import AIR
+from world import Chunk
+
+def spiral(world, position):
+    '''Returns the keys of every chunk of the world, ring by ring out
+    from the chunk at position, going round each ring in turn.'''
+    center_x = int(math.floor(position[0])) >> 4
+    center_z = int(math.floor(position[2])) >> 4
+    keys = []
+    for key_x in range(0, (world.size + 15) >> 4):
+        for key_z in range(0, (world.size + 15) >> 4):
+            dx, dz = key_x - center_x, key_z - center_z
+            keys.append((max(abs(dx), abs(dz)), math.atan2(dz, dx), (key_x, key_z)))
+    keys.sort()
+    return [key for ring, angle, key in keys]
+
+class Streamer:
+    '''Keeps the chunks near the player generated and meshed.
+
+    A chunk is meshed once the trees of every chunk around it are
+    planted, since those are the last things that can change it.
+
+    Chunks are unloaded once they are unload_margin past the distance
+    they are loaded at, so walking back and forth over a chunk border
+    does not load and unload the same chunks over and over.  Past
+    max_chunks the chunks used longest ago go first, though never
+    ones in view or still wanted, and the chunks past the view
+    distance are only loaded as far as max_chunks leaves room for.
+
+    Chunks further away than the first of lod_distances are meshed
+    from bigger blocks (see mesher.lod_scale), and meshed again
+    whenever the player moves them into another ring.
+
+    With fill set the whole of a finite world is loaded, in a spiral
+    out from where the player first is, and never unloaded.  Each
+    generated chunk is lit again and marked unsaved once nothing more
+    can grow into it or the chunks around it, so the whole world ends
+    up in the store with the light it would have had if it had been
+    generated all at once.'''
+
+    def __init__(self, world, terrain, processes=None, atlas=None, greedy=False, mesh_queue_size=8,
+                 store=None, max_chunks=1024, unload_margin=32, lod_distances=mesher.lod_distances, fill=False):
+        self.world = world
+        self.terrain = terrain
+        self.atlas = atlas
+        self.greedy = greedy
+        self.store = store or MemoryStore()
+        self.max_chunks = max_chunks
+        self.unload_margin = unload_margin
+        self.lod_distances = lod_distances
+        self.fill = fill
+
+        # the chunks left to load when filling the world
+        self.remaining = None
+
+        # chunk keys being generated, the trees of each generated
+        # chunk, the chunks whose trees are planted and the chunks
+        # waiting on or sitting in the mesh queues
+        self.requested = set()
+        self.results = {}
+        self.trees = {}
+        self.planted = set()
+        self.meshing = set()
+
+        # when each chunk was last wanted, counted in frames
+        self.used = {}
+        self.frame = 0
+        self.center = None
+
+        self.generated = queue.Queue()
+        self.jobs = queue.Queue()
+        self.meshes = queue.Queue(mesh_queue_size)
+
+        # a thread stands in for the pool where processes cannot be used
+        if processes == 1:
+            self.pool = ThreadPool(1, start_worker, (terrain,))
+            self.processes = 1
+        else:
+            self.pool = multiprocessing.Pool(processes, start_worker, (terrain,))
+            self.processes = processes or multiprocessing.cpu_count()
+
+        thread = threading.Thread(target=self.mesh_chunks)
+        thread.daemon = True
+        thread.start()
+
+    def inside(self, key):
+        return 0 <= key[0] << 4 < self.world.size and 0 <= key[1] << 4 < self.world.size
+
+    def around(self, key):
+        '''The keys of a chunk and the eight chunks around it that
+        are inside the world.'''
+        keys = []
+        for dx in [-1, 0, 1]:
+            for dz in [-1, 0, 1]:
+                other = (key[0] + dx, key[1] + dz)
+                if self.inside(other):
+                    keys.append(other)
+        return keys
+
+    def wanted(self, position, direction, distance):
+        '''Returns the keys of the chunks within distance of position,
+        most wanted first.  Chunks in the direction the player is
+        looking count as up to half as far away as they really are.'''
+        length = math.sqrt(direction[0]**2 + direction[2]**2) or 1.0
+        keys = []
+        reach = int(distance) // 16 + 1
+        center_x = int(math.floor(position[0])) >> 4
+        center_z = int(math.floor(position[2])) >> 4
+        for key_x in range(center_x - reach, center_x + reach + 1):
+            for key_z in range(center_z - reach, center_z + reach + 1):
+                if not self.inside((key_x, key_z)):
+                    continue
+                dx = (key_x << 4) + 8 - position[0]
+                dz = (key_z << 4) + 8 - position[2]
+                away = math.sqrt(dx * dx + dz * dz)
+                if away > distance:
+                    continue
+                facing = 0.0
+                if away > 0:
+                    facing = (dx * direction[0] + dz * direction[2]) / (away * length)
+                keys.append((away * (0.75 - 0.25 * facing), (key_x, key_z)))
+        keys.sort()
+        return [key for priority, key in keys]
+
+    def update(self, position, direction, view_distance):
+        '''Called once a frame.  Takes in the chunks that finished
+        generating, asks for the next ones and hands the chunks that
+        need a new mesh to the mesh thread.  Returns the chunks that
+        were unloaded, whose vertex buffers the caller has to free.'''
+        self.frame += 1
+        self.receive()
+
+        # meshing a chunk needs the trees of the chunks around it,
+        # which need the chunks around those, so the chunks a little
+        # over two chunks past the view distance are loaded as well,
+        # as far as max_chunks allows
+        fits = 16 * math.sqrt(self.max_chunks / math.pi) - 16
+        load_distance = max(view_distance, min(view_distance + 48, fits))
+        if self.fill:
+            if self.remaining is None:
+                self.remaining = collections.deque(spiral(self.world, position))
+            loaded = 0
+            while self.remaining and len(self.requested) < self.processes * 2 and loaded < self.processes * 2:
+                self.load(self.remaining.popleft())
+                loaded += 1
+        else:
+            for key in self.wanted(position, direction, load_distance):
+                if len(self.requested) < self.processes * 2:
+                    self.load(key)
+                if key in self.world.chunks or key in self.requested:
+                    self.used[key] = self.frame
+
+        for key in self.wanted(position, direction, view_distance):
+            if len(self.meshing) >= self.meshes.maxsize:
+                break
+            chunk = self.world.chunks.get(key)
+            if chunk is None or key in self.meshing:
+                continue
+            away = math.sqrt((chunk.x + 8 - position[0])**2 + (chunk.z + 8 - position[2])**2)
+            scale = mesher.lod_scale(away, self.lod_distances)
+            if not chunk.dirty and chunk.scale == scale:
+                continue
+            if all([other in self.planted for other in self.around(key)]):
+                chunk.dirty = False
+                self.meshing.add(key)
+                self.jobs.put((chunk, scale, chunk.edits))
+
+        # only looks for chunks to unload when there may be new ones
+        center = (int(math.floor(position[0])) >> 4, int(math.floor(position[2])) >> 4)
+        if self.fill:
+            return []
+        if center != self.center or len(self.world.chunks) > self.max_chunks:
+            self.center = center
+            return self.evict(position, view_distance, load_distance + self.unload_margin)
+        return []
+
+    def load(self, key):
+        '''Loads a chunk from the store, or asks for it to be
+        generated if it has never been saved.'''
+        if key in self.requested or key in self.world.chunks:
+            return
+        saved = self.store.load(key[0] << 4, key[1] << 4)
+        if saved is not None:
+            self.add(key[0] << 4, key[1] << 4, saved[0], saved[1])
+            return
+        self.requested.add(key)
+        self.results[key] = self.pool.apply_async(generate_column, ((key[0] << 4, key[1] << 4),),
+                                                  callback=self.generated.put)
+
+    def filled(self):
+        '''Tells whether every chunk of the world has been loaded and
+        had its trees planted, when filling the world.'''
+        return self.remaining is not None and not self.remaining and not self.requested and \
+               len(self.planted) == len(self.world.chunks)
+
+    def receive(self, limit=4):
+        '''Adds up to limit generated chunks to the world, and gives
+        up on the chunks whose generation failed, so they are asked
+        for again.'''
+        for key, result in list(self.results.items()):
+            if result.ready() and not result.successful():
+                try:
+                    result.get()
+                except Exception:
+                    print("Generating the chunk at %d, %d failed:" % (key[0] << 4, key[1] << 4))
+                    traceback.print_exc()
+                del self.results[key]
+                self.requested.discard(key)
+                self.used.pop(key, None)
+                if self.fill:
+                    self.remaining.append(key)
+        for i in range(0, limit):
+            try:
+                x, z, chunk_blocks, trees = self.generated.get_nowait()
+            except queue.Empty:
+                return
+            self.requested.discard((x >> 4, z >> 4))
+            self.results.pop((x >> 4, z >> 4), None)
+            self.add(x, z, chunk_blocks, trees=trees)
+
+    def add(self, x, z, chunk_blocks, light=None, trees=None):
+        '''Puts a chunk into the world.  A generated chunk comes as an
+        array of block ids, a chunk coming back from the store as the
+        Sections of its blocks and light, and where its trees go is
+        worked out again.'''
+        key = (x >> 4, z >> 4)
+        chunk = Chunk(x, z, self.world)
+        self.world.add(chunk)
+        if light is None:
+            chunk.blocks.fill(chunk_blocks)
+            self.world.generate_chunk_light(chunk)
+        else:
+            chunk.blocks = chunk_blocks
+            chunk.light = light
+            chunk.heights = sky_heights(chunk_blocks.dense() != AIR)
+            chunk.modified = True
+        if trees is None:
+            trees = self.terrain.trees(x, z, self.terrain.heights(x, z))
+        self.trees[key] = trees
+        for other in self.around(key):
+            self.plant(other)
+
+    def plant(self, key):
+        '''Plants the trees of a chunk once it and every chunk around
+        it have been generated.  Trees never grow into a chunk the
+        player has changed, it already holds everything it should.'''
+        if key in self.planted:
+            return
+        nearby = []
+        kept = []
+        for other in self.around(key):
+            if other not in self.trees:
+                return
+            nearby.extend(self.trees[other])
+            chunk = self.world.chunks[other]
+            if chunk.modified:
+                kept.append((chunk, chunk.blocks.copy()))
+        self.terrain.plant_trees(self.world, self.trees[key], nearby)
+        for chunk, chunk_blocks in kept:
+            chunk.blocks = chunk_blocks
+        self.planted.add(key)
+
+        # a chunk is done once the trees around it are all planted,
+        # which may change the light of the done chunks around it, so
+        # they are all lit again before they are saved, even the ones
+        # saved before a chunk next to them was done
+        if self.fill:
+            relit = set()
+            for other in self.around(key):
+                if self.done(other):
+                    relit.update([near for near in self.around(other) if self.done(near)])
+            for near in relit:
+                chunk = self.world.chunks[near]
+                light_chunk(self.world, chunk)
+                chunk.touch()
+                chunk.unsaved = True
+
+    def done(self, key):
+        '''Tells whether nothing more can grow into a chunk.'''
+        return all([other in self.planted for other in self.around(key)])
+
+    def evict(self, position, view_distance, unload_distance):
+        '''Unloads every chunk past unload_distance, then the chunks
+        used longest ago until there are no more than max_chunks,
+        though never the ones wanted this frame.  Returns the chunks
+        unloaded.'''
+        keep = []
+        unload = []
+        for key in self.world.chunks:
+            if key in self.meshing:
+                continue
+            away = math.sqrt(((key[0] << 4) + 8 - position[0])**2 + ((key[1] << 4) + 8 - position[2])**2)
+            if away > unload_distance:
+                unload.append(key)
+            elif away > view_distance and self.used.get(key, 0) != self.frame:
+                keep.append((self.used.get(key, 0), key))
+        extra = len(self.world.chunks) - len(unload) - self.max_chunks
+        if extra > 0:
+            keep.sort()
+            unload.extend([key for used, key in keep[:extra]])
+        return [self.unload(key) for key in unload]
+
+    def unload(self, key):
+        '''Takes a chunk out of the world, saving it first if the
+        player has changed it since it was last saved.'''
+        chunk = self.world.chunks.pop(key)
+        if chunk.unsaved:
+            save_chunks(self.world, self.store, [chunk])
+        del self.trees[key]
+        self.used.pop(key, None)
+
+        # the trees around the chunk reach into it, so they are
+        # planted again when it comes back
+        for other in self.around(key):
+            self.planted.discard(other)
+        return chunk
+
+    def resident(self):
+        '''Returns how many chunks are loaded and the bytes their
+        block data and meshes take up.'''
+        chunks = list(self.world.chunks.values())
+        nbytes = sum([chunk.nbytes() + chunk.vertex_count * mesher.vertex_size * 4 for chunk in chunks])
+        return len(chunks), nbytes
+
+    def mesh_chunks(self):
+        '''Runs on the mesh thread, lighting and meshing each chunk it
+        is given and working out which sides of its sections see
+        each other.
+
+        The face flags and light are worked out on a copy of the
+        chunk, and only given to the chunk by finished, so nothing the
+        main thread changes meanwhile is undone.  A chunk that fails
+        to mesh is marked dirty, to be meshed again.'''
+        while True:
+            chunk, scale, edits = self.jobs.get()
+            try:
+                work = copy.copy(chunk)
+                self.world.update_chunk_neighbors(work)
+                light = light_chunk(self.world, work)
+                vertices, batches = mesher.build_mesh(self.world, work, self.atlas, self.greedy, light, scale)
+                work.scale = scale
+                work.connections = visibility.connections(work.blocks)
+            except Exception:
+                print("Meshing the chunk at %d, %d failed:" % (chunk.x, chunk.z))
+                traceback.print_exc()
+                chunk.dirty = True
+                self.meshing.discard((chunk.x >> 4, chunk.z >> 4))
+                continue
+            self.meshes.put((chunk, edits, work, vertices, batches))
+
+    def finished(self, deadline):
+        '''Yields (chunk, vertices, batches) for each finished mesh
+        until the deadline has passed.  Always yields at least one
+        mesh if there is one, so the queue keeps moving.
+
+        A chunk changed since its mesh was asked for keeps its own
+        face flags and light, which are newer, and is still dirty, so
+        it is meshed again.'''
+        while True:
+            try:
+                chunk, edits, work, vertices, batches = self.meshes.get_nowait()
+            except queue.Empty:
+                return
+            self.meshing.discard((chunk.x >> 4, chunk.z >> 4))
+            if chunk.edits == edits:
+                chunk.blocked = work.blocked
+                chunk.light = work.light
+                chunk.heights = work.heights
+            chunk.scale = work.scale
+            chunk.connections = work.connections
+            yield chunk, vertices, batches
+            if time.time() >= deadline:
+                return
+
+    def close(self):
+        '''Saves every changed chunk and stops the workers.'''
+        save_chunks(self.world, self.store)
+        self.store.close()
+        self.pool.terminate()
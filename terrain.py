@@ -0,0 +1,196 @@
+'''Generates the terrain of the world one chunk at a time, spread
+over a pool of processes.
+
+Every chunk is worked out from the seed alone, so chunks can be made
+in any order, in any process.  Workers send back only the block id
+array of each chunk.  Trees are the one thing that reach across chunk
+borders; they are planted afterwards, in a fixed order, once every
+chunk is back.'''
+
+import multiprocessing, random
+
+import numpy
+
+import blocks
+from blocks import AIR, BEDROCK, STONE
+from noise import Noise, hash
+from world import Chunk
+
+# the blocks an iron ore vein may grow into around its center
+ore_offsets = [
+    (-1, 0, 0), (+1, 0, 0),
+    (0, -1, 0), (0, +1, 0),
+    (0, 0, -1), (0, 0, +1),
+    (-1, -1, -1), (+1, -1, -1), (-1, -1, +1), (+1, -1, +1),
+    (-1, +1, -1), (+1, +1, -1), (-1, +1, +1), (+1, +1, +1) ]
+
+class Terrain:
+    '''Everything needed to generate a chunk of the world.'''
+
+    def __init__(self, seed, size, height, min_terrain, max_terrain, water_level, generate_underground=False):
+        self.seed = seed
+        self.size = size
+        self.height = height
+        self.min_terrain = min_terrain
+        self.max_terrain = max_terrain
+        self.water_level = water_level
+        self.generate_underground = generate_underground
+        self.noise = Noise(seed)
+
+    def random(self, x, z, kind):
+        '''Returns a random number generator for one kind of feature
+        of the chunk at x, z that always gives the same numbers.'''
+        return random.Random(int(hash(self.seed, x >> 4, kind, z >> 4) * (1 << 53)))
+
+    def heights(self, x, z):
+        '''Returns the height of each column of the chunk at x, z.'''
+        noise = self.noise.perlin_grid(x, z, 16, 16)
+        return self.min_terrain + (noise * (self.max_terrain - self.min_terrain)).astype(int)
+
+    def generate_chunk(self, x, z):
+        '''Returns the block ids of the chunk at x, z and the trees
+        that want to grow in it.'''
+        chunk_blocks = numpy.zeros((16, self.height, 16), numpy.uint8)
+        chunk_blocks[:, 0:1, :] = BEDROCK
+        chunk_blocks[:, 1:self.min_terrain, :] = STONE
+
+        # grass or sand on top, then dirt, then stone
+        heights = self.heights(x, z)
+        y = numpy.arange(0, self.height)[numpy.newaxis, :, numpy.newaxis]
+        top = heights[:, numpy.newaxis, :]
+        ground = (y >= self.min_terrain) & (y <= top)
+        chunk_blocks[ground & (y < top - 2)] = STONE
+        chunk_blocks[ground & (y >= top - 2) & (y < top)] = blocks.DIRT
+        surface = numpy.where(top > self.water_level, blocks.GRASS, blocks.SAND)
+        chunk_blocks[:] = numpy.where(ground & (y == top), surface, chunk_blocks)
+
+        # ore veins may spill over from the chunks around this one
+        for chunk_x in [x - 16, x, x + 16]:
+            for chunk_z in [z - 16, z, z + 16]:
+                for ore_x, ore_y, ore_z in self.ores(chunk_x, chunk_z):
+                    if x <= ore_x < x + 16 and z <= ore_z < z + 16 and 0 <= ore_y < self.height:
+                        chunk_blocks[ore_x - x, ore_y, ore_z - z] = blocks.IRON
+
+        if self.generate_underground:
+            self.generate_caves(chunk_blocks, x, z)
+
+        return chunk_blocks, self.trees(x, z, heights)
+
+    def ores(self, x, z):
+        '''Returns the blocks of the iron ore veins started by the
+        chunk at x, z, which may reach into the chunks around it.'''
+        if x < 0 or z < 0 or x >= self.size or z >= self.size:
+            return []
+        generator = self.random(x, z, 1)
+        ores = []
+        amount = generator.randint(5, 8)
+        for i in range(0, amount):
+            ore_x = generator.randint(x, x + 16)
+            ore_y = generator.randint(1, self.min_terrain - 1)
+            ore_z = generator.randint(z, z + 16)
+            if ore_x == 0:
+                ore_x += 1
+            if ore_x == self.size - 1:
+                ore_x -= 1
+            if ore_z == 0:
+                ore_z += 1
+            if ore_z == self.size - 1:
+                ore_z -= 1
+            if ore_y == 0:
+                ore_y += 1
+            ores.append((ore_x, ore_y, ore_z))
+            for offset in ore_offsets:
+                if generator.choice([True, False]):
+                    ores.append((ore_x + offset[0], ore_y + offset[1], ore_z + offset[2]))
+        return [ore for ore in ores if 0 <= ore[0] < self.size and 0 <= ore[2] < self.size]
+
+    def generate_caves(self, chunk_blocks, x, z, threshold=0.53):
+        '''Carves caves out of a chunk wherever the 3D noise of the
+        whole chunk, worked out in one go, goes over the threshold.'''
+        density = self.noise.perlin_grid_3d(x, 2, z, 16, self.height - 2, 16)
+        carve = density > threshold
+
+        # leaves the edges of the world closed
+        xs = numpy.arange(x, x + 16)
+        zs = numpy.arange(z, z + 16)
+        carve &= ((xs >= 1) & (xs < self.size - 1))[:, numpy.newaxis, numpy.newaxis]
+        carve &= ((zs >= 1) & (zs < self.size - 1))[numpy.newaxis, numpy.newaxis, :]
+        chunk_blocks[:, 2:, :][carve] = AIR
+
+    def trees(self, x, z, heights):
+        '''Picks where a tree may grow in the chunk at x, z.  Returns
+        a list of (x, y, z, trunk height).'''
+        low_x, high_x = max(x, 2), min(x + 15, self.size - 3)
+        low_z, high_z = max(z, 2), min(z + 15, self.size - 3)
+        if low_x > high_x or low_z > high_z:
+            return []
+        generator = self.random(x, z, 2)
+        tree_x = generator.randint(low_x, high_x)
+        tree_z = generator.randint(low_z, high_z)
+        return [(tree_x, int(heights[tree_x - x, tree_z - z]) + 1, tree_z, generator.randint(3, 5))]
+
+    def plant_trees(self, world, trees, nearby=None):
+        '''Plants trees, skipping any that would grow into one of the
+        nearby trees (all of the trees given, unless told otherwise).
+        Trees spill into the chunks around them, so this runs once
+        those chunks are made, going through the trees in order of
+        position so the same seed always grows the same forest.'''
+        trees = sorted(trees)
+        if nearby is None:
+            nearby = trees
+        for tree in trees:
+            x, y, z, height = tree
+            if not world.contains(x, y - 1, z) or y < self.water_level:
+                continue
+            crowded = False
+            for other in nearby:
+                if other is not tree and abs(other[0] - x) < 3 and abs(other[2] - z) < 3:
+                    crowded = True
+            if not crowded:
+                self.generate_tree(world, x, y, z, height)
+
+    def generate_tree(self, world, x, y, z, height):
+        for i in range(y, y + height):
+            world.set(x, i, z, blocks.TREE)
+        for i in [x - 1, x, x + 1]:
+            for j in [y + height - 1, y + height]:
+                for k in [z - 1, z, z + 1]:
+                    if i != x or k != z or j == y + height:
+                        world.set(i, j, k, blocks.LEAF)
+
+# the terrain each worker process generates chunks for
+worker_terrain = None
+
+def start_worker(terrain):
+    global worker_terrain
+    worker_terrain = terrain
+
+def generate_column(position):
+    '''Runs in a worker, generating the chunk at position.'''
+    x, z = position
+    chunk_blocks, trees = worker_terrain.generate_chunk(x, z)
+    return x, z, chunk_blocks, trees
+
+def generate_world(world, terrain, processes=None):
+    '''Fills the world with generated chunks, using a pool of
+    processes (one per core unless told otherwise).'''
+    positions = [(x, z) for x in range(0, world.size, 16) for z in range(0, world.size, 16)]
+    if processes == 1:
+        start_worker(terrain)
+        results = map(generate_column, positions)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, start_worker, (terrain,))
+        results = pool.imap_unordered(generate_column, positions, 4)
+
+    trees = []
+    for x, z, chunk_blocks, chunk_trees in results:
+        chunk = Chunk(x, z, world)
+        chunk.blocks.fill(chunk_blocks)
+        world.add(chunk)
+        trees.extend(chunk_trees)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    terrain.plant_trees(world, trees)
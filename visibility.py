@@ -0,0 +1,133 @@
+'''Finds the chunks the camera might see into through caves and open
+air, so chunks buried behind solid rock are never drawn.
+
+Every chunk is cut into sections 16 blocks high.  For each section
+we work out which of its six sides can see each other through the
+air inside it.  To find what the camera might see, a breadth first
+search walks from the section the camera is in to the sections
+around it, only leaving a section through a side that can be seen
+from the side it came in through, and never heading back towards
+the camera.  This is the cave culling Tommaso Checchi described for
+Minecraft.'''
+
+import collections
+
+import numpy
+
+from blocks import AIR
+from sections import section_height
+from world import block_normals, opposite_faces
+
+# a section with air all the way through, where every side sees every other
+all_connected = numpy.ones((6, 6), bool)
+
+def label(air):
+    '''Gives every air block the same number as every other air block
+    it is joined to through the air, and solid blocks 0.  air is
+    indexed [x, section, y, z] and air never joins across sections.'''
+    labels = numpy.where(air, numpy.arange(1, air.size + 1).reshape(air.shape), 0)
+    biggest = air.size + 1
+    while True:
+        lowest = numpy.where(air, labels, biggest)
+        joined = lowest.copy()
+        for axis in [0, 2, 3]:
+            ahead = [slice(None)] * 4
+            behind = [slice(None)] * 4
+            ahead[axis] = slice(1, None)
+            behind[axis] = slice(0, -1)
+            joined[tuple(ahead)] = numpy.minimum(joined[tuple(ahead)], lowest[tuple(behind)])
+            joined[tuple(behind)] = numpy.minimum(joined[tuple(behind)], lowest[tuple(ahead)])
+        joined = numpy.where(air, joined, 0)
+
+        # every block takes the number of the block its number came
+        # from, which joins long winding caves in a few passes
+        flat = joined.ravel()
+        joined = numpy.where(air, flat[numpy.maximum(joined, 1) - 1], 0)
+        if (joined == labels).all():
+            return labels
+        labels = joined
+
+def connections(blocks):
+    '''Returns which sides of each section of a chunk can see each
+    other through the air in it, indexed [section, side, side], with
+    the sides in the same order as the faces of a block.  blocks are
+    the Sections of the block ids of the chunk.  Sections all of air
+    or all solid are settled without looking inside them.'''
+    sections = blocks.count
+    connected = numpy.zeros((sections, 6, 6), bool)
+    mixed = []
+    for section in range(0, sections):
+        value = blocks.uniform(section)
+        bottom, top = blocks.span(section)
+        if value is None or (value != AIR and top - bottom < section_height):
+            mixed.append(section)
+        elif value == AIR:
+            connected[section] = True
+    if not mixed:
+        return connected
+
+    # the part of the last section over the top of the world is open sky
+    air = numpy.ones((16, len(mixed), section_height, 16), bool)
+    for i, section in enumerate(mixed):
+        part = blocks.section(section)
+        air[:, i, 0:part.shape[1], :] = part == AIR
+
+    labels = label(air)
+    for i, section in enumerate(mixed):
+        inside = labels[:, i]
+        if not inside.any():
+            continue
+        if inside.all():
+            connected[section] = True
+            continue
+        sides = [inside[:, :, -1], inside[:, :, 0],
+                 inside[-1, :, :], inside[0, :, :],
+                 inside[:, -1, :], inside[:, 0, :]]
+        sides = [numpy.unique(side[side != 0]) for side in sides]
+        for a in range(0, 6):
+            for b in range(a, 6):
+                if len(numpy.intersect1d(sides[a], sides[b], assume_unique=True)) > 0:
+                    connected[section, a, b] = connected[section, b, a] = True
+    return connected
+
+def visible_chunks(world, position, distance):
+    '''Returns the keys of the chunks within distance of position the
+    camera might see into, or None if the camera is under the world,
+    where nothing can be ruled out.
+
+    Chunks that have not had their sections worked out yet count as
+    open all the way through, so they are never hidden by mistake.
+    So does a layer of sections just over the top of the world, which
+    lets the search find its way over mountains.'''
+    x, y, z = [int(numpy.floor(c)) for c in position]
+    if y < 0:
+        return None
+    layers = (world.height + section_height - 1) // section_height
+    start = (x >> 4, min(y // section_height, layers), z >> 4)
+    reach = distance // 16 + 2
+
+    seen = set([start])
+    queue = collections.deque([(start, None, 0)])
+    while queue:
+        section, entered, headed = queue.popleft()
+        chunk = world.chunks.get((section[0], section[2]))
+        connected = all_connected
+        if chunk is not None and chunk.connections is not None and section[1] < layers:
+            connected = chunk.connections[section[1]]
+        for side, normal in enumerate(block_normals):
+            if entered is not None and not connected[entered, side]:
+                continue
+
+            # never turns back towards the camera
+            if headed & (1 << opposite_faces[side]):
+                continue
+            other = (section[0] + normal[0], section[1] + normal[1], section[2] + normal[2])
+            if other in seen or other[1] < 0 or other[1] > layers:
+                continue
+            if other[0] < 0 or other[2] < 0 or other[0] << 4 >= world.size or other[2] << 4 >= world.size:
+                continue
+            if abs(other[0] - start[0]) > reach or abs(other[2] - start[2]) > reach:
+                continue
+            seen.add(other)
+            queue.append((other, opposite_faces[side], headed | (1 << side)))
+    return set([(section[0], section[2]) for section in seen])
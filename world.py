@@ -0,0 +1,437 @@
+import math
+
+import numpy
+
+import light
+from blocks import block_types, AIR, BEDROCK, STONE
+from columns import Columns
+from sections import Sections, section_height
+
+# the six directions a block face can point, in the same order as
+# the faces of a block (front, back, right, left, top, bottom)
+block_normals = [
+    (0, 0, +1),  # front
+    (0, 0, -1),  # back
+    (+1, 0, 0),  # right
+    (-1, 0, 0),  # left
+    (0, +1, 0),  # top
+    (0, -1, 0) ] # bottom
+
+# the face on the other side of each face
+opposite_faces = [1, 0, 3, 2, 5, 4]
+
+# a block with every face hidden
+all_blocked = (1 << len(block_normals)) - 1
+
+class Chunk:
+    '''A 16 x height x 16 column of blocks.  Every kind of block
+    data lives in its own Sections indexed [x, y, z] (see sections.py),
+    or for the block ids of a world of columns, Columns (see columns.py):
+
+    blocks  - the id of the block type (see blocks.py)
+    light   - the light level of the block (see light.py)
+    blocked - one bit per face, set when that face is hidden
+
+    heights holds the lowest y the sky reaches in each column.'''
+
+    def __init__(self, x, z, world):
+        self.x = x
+        self.z = z
+        if world.columns:
+            self.blocks = Columns(world.height, AIR)
+        else:
+            self.blocks = Sections(world.height, AIR, packed=world.packed)
+        self.light = Sections(world.height, 0)
+        self.blocked = Sections(world.height, 0)
+
+        # bedrock at the bottom with stone up to the minimum terrain height
+        self.blocks.fill(BEDROCK, 0, 1)
+        self.blocks.fill(STONE, 1, world.min_terrain)
+        self.blocked.fill(all_blocked, 0, world.min_terrain)
+        self.heights = numpy.zeros((16, 16), int) + world.min_terrain
+
+        # set once the player changes the chunk, and unsaved until
+        # the change has been saved
+        self.modified = False
+        self.unsaved = False
+
+        # set whenever the blocks change so the mesh gets rebuilt, and
+        # how many times the blocks, face flags or light were changed,
+        # so a mesh built while they changed is known to be out of date
+        self.dirty = True
+        self.edits = 0
+        self.mesh = None
+        self.batches = []
+        self.vertex_count = 0
+
+        # the box around the mesh, (min x, y, z, max x, y, z)
+        self.bounds = None
+
+        # how big the blocks the mesh was built from are, more than
+        # one for distant chunks (see mesher.lod_scale)
+        self.scale = 1
+
+        # which sides of each section see each other (see visibility.py)
+        self.connections = None
+
+        # the occlusion query of the chunk, whether it was hidden the
+        # last time it was asked and the frame it was last asked in
+        self.query = None
+        self.querying = False
+        self.occluded = False
+        self.queried = None
+
+    def nbytes(self):
+        '''The memory used by the block data of the chunk.'''
+        return self.blocks.nbytes + self.light.nbytes + self.blocked.nbytes
+
+    def dense_nbytes(self):
+        '''The memory the block data of the chunk would use as plain
+        arrays, for comparison.'''
+        return 3 * 16 * self.blocks.height * 16
+
+    def touch(self):
+        '''Marks the chunk as changed, so it gets a new mesh.'''
+        self.dirty = True
+        self.edits += 1
+
+    def top(self):
+        '''Returns the y every block from there up is air.'''
+        for index in range(self.blocks.count - 1, -1, -1):
+            if self.blocks.uniform(index) != AIR:
+                return self.blocks.span(index)[1]
+        return 0
+
+    def solid_sections(self):
+        '''Returns how many sections at the bottom of the chunk hold
+        nothing but solid blocks.'''
+        for index in range(0, self.blocks.count):
+            if self.blocks.uniform(index) in [None, AIR]:
+                return index
+        return self.blocks.count
+
+class World:
+    '''Holds every chunk in the world.  Chunks are kept in a
+    dictionary keyed by their chunk coordinates (x // 16, z // 16)
+    so finding the chunk a block lives in never needs a search.
+
+    With packed set the block ids of the chunks are kept palette
+    packed (see sections.py), with columns set they are kept as runs
+    down each column (see columns.py).'''
+
+    def __init__(self, size, height, min_terrain, generate_underground=False, maximum_light=15, minimum_light=5,
+                 packed=False, columns=False):
+        self.size = size
+        self.height = height
+        self.min_terrain = min_terrain
+        self.generate_underground = generate_underground
+        self.maximum_light = maximum_light
+        self.minimum_light = minimum_light
+        self.packed = packed
+        self.columns = columns
+        self.chunks = {}
+
+    def generate_chunks(self):
+        '''Creates all the chunks that make up the world.'''
+        for x in range(0, self.size, 16):
+            for z in range(0, self.size, 16):
+                self.add(Chunk(x, z, self))
+
+    def add(self, chunk):
+        self.chunks[(chunk.x // 16, chunk.z // 16)] = chunk
+
+    def chunk_at(self, x, z):
+        '''Returns the chunk holding the block column at x, z, or
+        None if that part of the world has no chunk.'''
+        return self.chunks.get((int(math.floor(x)) >> 4, int(math.floor(z)) >> 4))
+
+    def contains(self, x, y, z):
+        block = self.get(x, y, z)
+        return block is not None and block != AIR
+
+    def get(self, x, y, z):
+        '''Returns the id of the block at x, y, z, or None if
+        that block is outside the world.'''
+        if y < 0 or y >= self.height:
+            return None
+        chunk = self.chunk_at(x, z)
+        if chunk is None:
+            return None
+        return int(chunk.blocks[int(math.floor(x)) - chunk.x, int(y), int(math.floor(z)) - chunk.z])
+
+    def set(self, x, y, z, new):
+        '''Sets the id of the block at x, y, z.'''
+        if y < 0 or y >= self.height:
+            return
+        chunk = self.chunk_at(x, z)
+        if chunk is None:
+            return
+        chunk.blocks[int(math.floor(x)) - chunk.x, int(y), int(math.floor(z)) - chunk.z] = new
+
+    def get_light(self, x, y, z):
+        if y < 0 or y >= self.height:
+            return None
+        chunk = self.chunk_at(x, z)
+        if chunk is None:
+            return None
+        return int(chunk.light[int(math.floor(x)) - chunk.x, int(y), int(math.floor(z)) - chunk.z])
+
+    def set_light(self, x, y, z, light):
+        if y < 0 or y >= self.height:
+            return
+        chunk = self.chunk_at(x, z)
+        if chunk is None:
+            return
+        chunk.light[int(math.floor(x)) - chunk.x, int(y), int(math.floor(z)) - chunk.z] = light
+
+    def set_blocked(self, x, y, z, face, blocked):
+        '''Hides or uncovers one face of the block at x, y, z.'''
+        if y < 0 or y >= self.height:
+            return
+        chunk = self.chunk_at(x, z)
+        if chunk is None:
+            return
+        x, y, z = int(math.floor(x)) - chunk.x, int(y), int(math.floor(z)) - chunk.z
+        if blocked:
+            chunk.blocked[x, y, z] |= 1 << face
+        else:
+            chunk.blocked[x, y, z] &= ~(1 << face) & all_blocked
+
+    def raycast(self, origin, direction, distance):
+        '''Follows a ray from origin along direction through every
+        block it passes, in order, using the voxel traversal of
+        Amanatides and Woo.
+
+        Returns (block, face, before) for the first solid block within
+        distance, where block is its x, y, z, face is the index of the
+        face the ray went in through and before is the x, y, z of the
+        block the ray came from.  face and before are None when the
+        ray starts inside a solid block.  Returns None on a miss.'''
+        position = [int(math.floor(c)) for c in origin]
+        length = math.sqrt(sum([c * c for c in direction]))
+        if length == 0:
+            return None
+        direction = [c / length for c in direction]
+
+        step = [0, 0, 0]
+        t_max = [float("inf")] * 3
+        t_delta = [float("inf")] * 3
+        for axis in [0, 1, 2]:
+            if direction[axis] > 0:
+                step[axis] = 1
+                t_max[axis] = (position[axis] + 1 - origin[axis]) / direction[axis]
+            elif direction[axis] < 0:
+                step[axis] = -1
+                t_max[axis] = (position[axis] - origin[axis]) / direction[axis]
+            if direction[axis] != 0:
+                t_delta[axis] = abs(1.0 / direction[axis])
+
+        face = None
+        before = None
+        t = 0.0
+        while t <= distance:
+            if self.contains(*position):
+                return tuple(position), face, before
+            axis = t_max.index(min(t_max))
+            t = t_max[axis]
+            before = tuple(position)
+            position[axis] += step[axis]
+            t_max[axis] += t_delta[axis]
+
+            # the ray goes in through the face pointing back at it
+            normal = [0, 0, 0]
+            normal[axis] = -step[axis]
+            face = block_normals.index(tuple(normal))
+        return None
+
+    def blocks_movement(self, x, y, z):
+        '''Tells whether something moving may not pass through the
+        block at x, y, z.  The edges of the world count as walls.'''
+        if x < 0 or z < 0 or x >= self.size or z >= self.size:
+            return True
+        return self.contains(x, y, z)
+
+    def sweep(self, box, motion, order=(0, 2, 1)):
+        '''Moves a box (min_x, min_y, min_z, max_x, max_y, max_z) by
+        motion one axis at a time, in the given order, stopping it
+        against the first solid block in its way on each axis.
+
+        Returns the motion that was actually made and, for each axis,
+        whether the box was stopped on that axis.'''
+        epsilon = 1e-7
+        low = list(box[0:3])
+        high = list(box[3:6])
+        moved = [0.0, 0.0, 0.0]
+        stopped = [False, False, False]
+        for axis in order:
+            distance = motion[axis]
+            if distance == 0:
+                continue
+
+            # the blocks the box overlaps on the other two axes
+            across = [a for a in [0, 1, 2] if a != axis]
+            spans = [range(int(math.floor(low[a])), int(math.ceil(high[a]))) for a in across]
+
+            # the layers of blocks the box sweeps through, nearest first
+            if distance > 0:
+                layers = range(int(math.ceil(high[axis] - epsilon)), int(math.ceil(high[axis] + distance)))
+            else:
+                layers = range(int(math.floor(low[axis] + epsilon)) - 1, int(math.floor(low[axis] + distance)) - 1, -1)
+            for layer in layers:
+                if self.layer_blocked(axis, layer, across, spans):
+                    if distance > 0:
+                        distance = max(min(distance, layer - high[axis]), 0.0)
+                    else:
+                        distance = min(max(distance, layer + 1 - low[axis]), 0.0)
+                    stopped[axis] = True
+                    break
+
+            low[axis] += distance
+            high[axis] += distance
+            moved[axis] = distance
+        return moved, stopped
+
+    def layer_blocked(self, axis, layer, across, spans):
+        '''Tells whether any block in one layer of a sweep blocks
+        movement.'''
+        position = [0, 0, 0]
+        position[axis] = layer
+        for a in spans[0]:
+            for b in spans[1]:
+                position[across[0]] = a
+                position[across[1]] = b
+                if self.blocks_movement(*position):
+                    return True
+        return False
+
+    def padded(self, chunk, name, below, above, outside, missing):
+        '''Returns one of the arrays of a chunk grown by one block on
+        every side, filled in from the neighboring chunks.  The extra
+        blocks take the value below underneath the world, above over
+        it, outside past the edge of the world and missing where a
+        chunk has not been created.'''
+        array = getattr(chunk, name)
+        padded = numpy.empty((18, self.height + 2, 18), array.dtype)
+        padded[:, 0, :] = below
+        padded[:, -1, :] = above
+        ranges = {-1: (slice(0, 1), slice(15, 16)),
+                  0: (slice(1, 17), slice(0, 16)),
+                  +1: (slice(17, 18), slice(0, 1))}
+        for dx in [-1, 0, +1]:
+            for dz in [-1, 0, +1]:
+                inside_x, border_x = ranges[dx]
+                inside_z, border_z = ranges[dz]
+                inside = (inside_x, slice(1, -1), inside_z)
+                x = chunk.x + dx * 16
+                z = chunk.z + dz * 16
+                if x < 0 or z < 0 or x >= self.size or z >= self.size:
+                    padded[inside] = outside
+                    continue
+                other = self.chunks.get((x >> 4, z >> 4))
+                if other is None:
+                    padded[inside] = missing
+                else:
+                    padded[inside] = getattr(other, name)[border_x, :, border_z]
+        return padded
+
+    def padded_solid(self, chunk):
+        '''Returns an 18 x height + 2 x 18 array telling which blocks
+        of the chunk, and the blocks around it, are solid.  Anything
+        outside the world counts as solid except for the sky above it.'''
+        return self.padded(chunk, "blocks", BEDROCK, AIR, BEDROCK, AIR) != AIR
+
+    def span(self, chunk):
+        '''Returns the bottom and top y of the part of a chunk that
+        may have faces showing.  Every block under bottom is solid,
+        and so is every block around it, in this chunk or the four
+        next to it, so all its faces are hidden.  Every block from
+        top up is air.'''
+        top = chunk.top()
+        solid = chunk.solid_sections()
+        for dx, dz in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            x = chunk.x + dx * 16
+            z = chunk.z + dz * 16
+            if x < 0 or z < 0 or x >= self.size or z >= self.size:
+                continue
+            other = self.chunks.get((x >> 4, z >> 4))
+            solid = min(solid, other.solid_sections() if other is not None else 0)
+
+        # the top faces of the last solid section may show
+        bottom = max(solid * section_height - 1, 0)
+        return min(bottom, top), top
+
+    def solid(self, x, y, z):
+        '''Tells whether the block at x, y, z hides the faces next to
+        it, counting the world the same way padded_solid does.'''
+        if y < 0:
+            return True
+        if y >= self.height:
+            return False
+        if x < 0 or z < 0 or x >= self.size or z >= self.size:
+            return True
+        return self.contains(x, y, z)
+
+    def change(self, x, y, z, new):
+        '''Sets the id of the block at x, y, z and updates the faces
+        it hides or uncovers and the light around it.'''
+        self.set(x, y, z, new)
+        self.update_faces(x, y, z)
+        light.relight(self, x, y, z)
+
+    def update_faces(self, x, y, z):
+        '''Updates the hidden face flags of the block at x, y, z and
+        the faces of the six blocks around it that look at it, which
+        may be in other chunks.  Every chunk touched is marked as
+        needing a new mesh.'''
+        chunk = self.chunk_at(x, z)
+        if chunk is None or y < 0 or y >= self.height:
+            return
+        solid = self.contains(x, y, z)
+        blocked = 0
+        for i, (dx, dy, dz) in enumerate(block_normals):
+            if solid and self.solid(x + dx, y + dy, z + dz):
+                blocked |= 1 << i
+            if self.contains(x + dx, y + dy, z + dz):
+                self.set_blocked(x + dx, y + dy, z + dz, opposite_faces[i], solid)
+                self.chunk_at(x + dx, z + dz).touch()
+        chunk.blocked[int(math.floor(x)) - chunk.x, int(y), int(math.floor(z)) - chunk.z] = blocked
+        chunk.touch()
+
+    def update_neighbors(self):
+        '''Updates the hidden face flags of every solid block.'''
+        for chunk in self.chunks.values():
+            self.update_chunk_neighbors(chunk)
+
+    def update_chunk_neighbors(self, chunk):
+        '''Updates the hidden face flags of the solid blocks in a
+        chunk by comparing the chunk against itself shifted one block
+        along each face normal.  Only the part of the chunk span
+        returns is compared, the rest is all hidden or all air.'''
+        bottom, top = self.span(chunk)
+        solid = self.padded_solid(chunk)[:, bottom:top + 2, :]
+        blocked = numpy.zeros((16, top - bottom, 16), numpy.uint8)
+        for i, (dx, dy, dz) in enumerate(block_normals):
+            neighbor = solid[1 + dx:17 + dx, 1 + dy:top - bottom + 1 + dy, 1 + dz:17 + dz]
+            blocked |= neighbor.astype(numpy.uint8) << i
+        blocked[chunk.blocks.dense(bottom, top) == AIR] = 0
+        chunk.blocked = Sections(self.height, 0)
+        chunk.blocked.fill(all_blocked, 0, bottom)
+        chunk.blocked.fill(blocked, bottom)
+
+    def generate_light(self):
+        '''Lights every block of the world.'''
+        light.light_world(self)
+
+    def generate_chunk_light(self, chunk):
+        '''Lights a chunk as if there was nothing around it.'''
+        bottom = chunk.solid_sections() * section_height
+        top = max(chunk.top(), bottom)
+        solid = chunk.blocks.dense(bottom, top) != AIR
+        heights = light.sky_heights(solid)
+        chunk.heights = heights + bottom
+        light.store_light(self, chunk, light.spread(solid, heights, self.maximum_light, self.minimum_light), bottom, top)
+
+    def breakable(self, x, y, z):
+        '''Tells whether the block at x, y, z can be destroyed.'''
+        block = self.get(x, y, z)
+        return block is not None and block_types[block].breakable